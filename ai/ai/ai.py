@@ -33,11 +33,30 @@ import openai
 import pandas as pd
 from ai.db.db import db
 from ai.app.file_handler import File
-from scipy import spatial  # for calculating vector similarities for search
+from ai.ai.index import file_index, cosine_top_n  # for calculating vector similarities for search
 import tiktoken  # for counting tokens
 from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterable, Iterator
 import numpy as np
 
+@lru_cache
+def get_encoding(model_name: str | None) -> tiktoken.Encoding:
+    """tiktoken encoding for a model, resolved once per model name"""
+    try:
+        return tiktoken.encoding_for_model(model_name=model_name)
+    except (KeyError, AttributeError):
+        # unknown or unset model name; the current OpenAI models all use cl100k_base
+        return tiktoken.get_encoding("cl100k_base")
+
+@lru_cache(maxsize=10_000)
+def count_tokens(encoding_name: str, text: str) -> int:
+    """Token count of a text, remembered so stored document segments are only tokenized
+    once per process (the first time at ingestion, when embedding batches are sized)"""
+    return len(tiktoken.get_encoding(encoding_name).encode(text))
+
 class AI:
 
     def __init__(
@@ -45,12 +64,18 @@ class AI:
             embedding_model_name: str,
             gpt_model_name: str,
             database: db,
-            token_limit: int=4096-500
+            token_limit: int=4096-500,
+            embedding_batch_tokens: int=8000,
+            embedding_batch_size: int=2048,
+            embedding_concurrency: int=4
         ) -> None:
         self.embedding_model_name = embedding_model_name
         self.gpt_model_name = gpt_model_name
         self.db = database
         self.token_limit = token_limit
+        self.embedding_batch_tokens = embedding_batch_tokens
+        self.embedding_batch_size = embedding_batch_size
+        self.embedding_concurrency = embedding_concurrency
 
     def _create_embedding(self, text):
         """
@@ -63,17 +88,52 @@ class AI:
             input=text
         )
 
+    def _embedding_batches(self, segments: Iterable[str]) -> Iterator[list[str]]:
+        """Packs segments, in order, into batches of at most `embedding_batch_tokens` tokens
+        and `embedding_batch_size` inputs, one batch per embeddings request"""
+        encoding = get_encoding(self.embedding_model_name)
+        batch, batch_tokens = [], 0
+        for segment in segments:
+            segment_tokens = count_tokens(encoding.name, segment)
+            if batch and (batch_tokens + segment_tokens > self.embedding_batch_tokens
+                          or len(batch) == self.embedding_batch_size):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(segment)
+            batch_tokens += segment_tokens
+        if batch:
+            yield batch
+
+    def _embed_batch(self, batch: list[str]) -> list[list[float]]:
+        response = self._create_embedding(batch)
+        data = sorted(response["data"], key=lambda resp_data_obj: resp_data_obj["index"])
+        # double check there is exactly one embedding per input, in the same order as the input
+        assert [resp_data_obj["index"] for resp_data_obj in data] == list(range(len(batch)))
+        return [embedding_object["embedding"] for embedding_object in data]
+
+    def embed_segments(self, segments: Iterable[str]) -> tuple[list[str], list[list[float]]]:
+        """Embeds the segments in token-bounded batches, with up to `embedding_concurrency`
+        requests in flight at once. Returns the segments and their embeddings in input order"""
+        texts, embeddings = [], []
+        in_flight = deque()
+        with ThreadPoolExecutor(max_workers=self.embedding_concurrency) as executor:
+            for batch in self._embedding_batches(segments):
+                in_flight.append((batch, executor.submit(self._embed_batch, batch)))
+                if len(in_flight) < self.embedding_concurrency:
+                    continue
+                batch, result = in_flight.popleft()
+                texts.extend(batch)
+                embeddings.extend(result.result())
+            for batch, result in in_flight:
+                texts.extend(batch)
+                embeddings.extend(result.result())
+        return texts, embeddings
+
     def generate_embeddings_table(self, file: File) -> pd.DataFrame:
         """Takes a file and creates an embeddings table"""
-        embeddings = []
-        segments = file.read_and_chunk(3)
-        for segment in segments:
-            print("Generating Embedding")
-            response = self._create_embedding(segment)
-            for i, resp_data_obj in enumerate(response["data"]):
-                assert i == resp_data_obj["index"]  # double check embeddings are in same order as input
-            batch_embeddings = [embedding_object["embedding"] for embedding_object in response["data"]]
-            embeddings.extend(batch_embeddings)
+        print("Generating Embeddings")
+        # pages are embedded as they come out of extraction
+        segments, embeddings = self.embed_segments(file.iter_chunks(3))
         print("segments complete")
         result = pd.DataFrame({'text': segments, 'embedding': embeddings})
         doc_embedding = list(np.mean(result['embedding'].tolist(), axis=0))
@@ -96,6 +156,7 @@ class AI:
             else:
                 entity_id = session.add_entity(entity)
                 file_id = session.add_file(file.file_name(), entity=entity_id, category=category, embedding=embedding)
+        file_index.add(file_id, embedding)
         return file_id
 
     
@@ -108,31 +169,28 @@ class AI:
     def rank_files_by_relatedness(
             self,
             query: tuple[float],
-            document_embeddings: pd.DataFrame,
-            relatedness_fn = lambda x, y: 1 - spatial.distance.cosine(x,y),
             top_n: int = 5
-        ) -> tuple[tuple[str], tuple[float]]:
-            files_and_relatedness = [(row.id, relatedness_fn(query,row.embedding))
-                                     for row in document_embeddings.itertuples()]
-            files_and_relatedness.sort(key=lambda li: li[1], reverse=True)
-            file_ids, relatedness = zip(*files_and_relatedness)
-            return file_ids[:top_n], relatedness[:top_n]
+        ) -> tuple[tuple[int], tuple[float]]:
+            """Ranks every file by the cosine similarity of its document embedding to the query,
+            using the resident file index (loaded from the database on first use)"""
+            if file_index.stale():
+                with self.db as session:
+                    file_index.load(session.get_files())
+            return file_index.top_n(query, top_n=top_n)
 
     def ranked_strings_by_relatedness(
             self,
             query: tuple[float],
             embeddings: pd.DataFrame,
-            relatedness_fn = lambda x, y: 1 - spatial.distance.cosine(x,y),
             top_n: int = 5
         ) -> tuple[tuple[str], tuple[float]]:
-        strings_and_relatedness = [(row.text, relatedness_fn(query, row.embedding))
-                                   for row in embeddings.itertuples()]
-        strings_and_relatedness.sort(key=lambda li: li[1], reverse=True)
-        strings, relatedness = zip(*strings_and_relatedness)
-        return strings[:top_n], relatedness[:top_n]
+        if embeddings.empty:
+            return (), ()
+        positions, relatedness = cosine_top_n(query, np.array(embeddings["embedding"].tolist()), top_n)
+        return tuple(embeddings["text"].to_numpy()[positions]), tuple(relatedness.tolist())
 
     def num_tokens(self, text: str|list[str]) -> int:
-        encoding = tiktoken.encoding_for_model(model_name=self.gpt_model_name)
+        encoding = get_encoding(self.gpt_model_name)
         if isinstance(text, str):
             tokens = encoding.encode(text=text)
             num_tokens = len(tokens)
@@ -148,26 +206,32 @@ class AI:
         query_embedding_resp = self._create_embedding(query)
         query_embedding = tuple(query_embedding_resp['data'][0]['embedding'])
 
-        with self.db as session:
-            all_files = session.get_files()
-        
-        top_related_file_ids, _ = self.rank_files_by_relatedness(query=query_embedding, document_embeddings=all_files)
-
-        with self.db as session:
-            top_file_embeddings = session.get_embeddings(file_id=top_related_file_ids)
+        top_related_file_ids, _ = self.rank_files_by_relatedness(query=query_embedding)
 
-        top_related_text, _ = self.ranked_strings_by_relatedness(query=query_embedding, embeddings=top_file_embeddings)
+        if top_related_file_ids:
+            with self.db as session:
+                top_file_embeddings = session.get_embeddings(file_id=list(top_related_file_ids))
+            top_related_text, _ = self.ranked_strings_by_relatedness(query=query_embedding, embeddings=top_file_embeddings)
+        else:
+            top_related_text = ()
         introduction = """Use the document segments below provided by vendors that explain topics such as warranty policies,
             product specifications, and installation instructions to answer the subsequent question. If the answer cannot be found
             in these document segments, write \"Sorry, I could not find an answer.\"\n"""
         question = f"\n\nQuestion: {query}"
+        segment_header = '\n\nDocument segment:\n"""\n'
+        # running total, so each piece is counted once instead of re-tokenizing the whole
+        # prompt per segment. Segment text counts are memoized by count_tokens
+        encoding_name = get_encoding(self.gpt_model_name).name
+        message_tokens = self.num_tokens([introduction, question])
+        header_tokens = self.num_tokens(segment_header)
         full_message = introduction
         for text in top_related_text:
-            next_segment = f'\n\nDocument segment:\n"""\n{text}'
-            if self.num_tokens(full_message + next_segment + question) > self.token_limit:
+            segment_tokens = header_tokens + count_tokens(encoding_name, text)
+            if message_tokens + segment_tokens > self.token_limit:
                 break
             else:
-                full_message += next_segment
+                full_message += segment_header + text
+                message_tokens += segment_tokens
         return full_message + question
     
     def _complete_chat(self, messages: list[dict[str,str]]):
@@ -0,0 +1,100 @@
+"""Resident index of file embeddings, for ranking files against a query
+without loading every file from the database on each question.
+
+Rows are normalized once when they enter the index, so cosine similarity
+against a query is a single matrix-vector product.
+"""
+import os
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+
+def normalize(vectors) -> np.ndarray:
+    """float32 copy of the vector(s) scaled to unit length"""
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def cosine_top_n(
+        query: tuple[float],
+        matrix: np.ndarray,
+        top_n: int,
+        normalized: bool = False
+    ) -> tuple[np.ndarray, np.ndarray]:
+    """Positions and cosine similarities of the `top_n` rows of `matrix` most related to `query`,
+    most related first"""
+    if not len(matrix):
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32)
+    if not normalized:
+        matrix = normalize(matrix)
+    scores = matrix @ normalize(query)[0]
+    top_n = min(top_n, len(scores))
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return top, scores[top]
+
+
+class EmbeddingIndex:
+    """
+    File id -> normalized embedding, held as one contiguous float32 matrix.
+    Writers build new arrays and swap them in under a lock, so readers never
+    need to lock. Each process has its own copy, which is reloaded from the
+    database once it is older than `max_age` seconds so files added through
+    another worker show up.
+    """
+
+    def __init__(self, max_age: float = 300) -> None:
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rows: tuple[np.ndarray, np.ndarray] = (
+            np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        )
+        self._loaded_at: float | None = None
+
+    def __len__(self) -> int:
+        return len(self._rows[0])
+
+    def stale(self) -> bool:
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.max_age
+
+    def load(self, files: pd.DataFrame) -> None:
+        """Replace the index with the `id` and `embedding` columns of `files`"""
+        if files.empty:
+            ids, matrix = np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+        else:
+            ids = files["id"].to_numpy(dtype=np.int64)
+            matrix = normalize(files["embedding"].tolist())
+        with self._lock:
+            self._rows = (ids, matrix)
+            self._loaded_at = time.monotonic()
+
+    def add(self, file_id: int, embedding: list[float]) -> None:
+        if self._loaded_at is None:
+            return  # picked up by the first load
+        with self._lock:
+            ids, matrix = self._rows
+            keep = ids != file_id
+            row = normalize(embedding)
+            if len(ids):
+                matrix = np.vstack((matrix[keep], row))
+            else:
+                matrix = row
+            self._rows = (np.append(ids[keep], file_id), matrix)
+
+    def remove(self, *file_ids: int) -> None:
+        with self._lock:
+            ids, matrix = self._rows
+            keep = ~np.isin(ids, file_ids)
+            self._rows = (ids[keep], matrix[keep])
+
+    def top_n(self, query: tuple[float], top_n: int = 5) -> tuple[tuple[int], tuple[float]]:
+        ids, matrix = self._rows
+        positions, relatedness = cosine_top_n(query, matrix, top_n, normalized=True)
+        return tuple(ids[positions].tolist()), tuple(relatedness.tolist())
+
+
+file_index = EmbeddingIndex(max_age=float(os.getenv("FILE_INDEX_MAX_AGE", 300)))
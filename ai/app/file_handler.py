@@ -1,9 +1,36 @@
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import Optional
+from typing import Iterator, Optional
 from pypdf import PdfReader
-import numpy as np
 from io import BytesIO
 
+EXTRACT_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+PAGES_PER_TASK = int(os.getenv('PDF_PAGES_PER_TASK', 8))
+
+# each extraction worker opens the document once, in its initializer
+_worker_reader: Optional[PdfReader] = None
+
+def _open_reader(source: bytes | str) -> None:
+    global _worker_reader
+    _worker_reader = PdfReader(BytesIO(source) if isinstance(source, bytes) else source)
+
+def _extract_pages(first: int, last: int) -> list[str]:
+    return [_worker_reader.pages[i].extract_text() for i in range(first, last)]
+
+def split_evenly(words: list[str], chunks: int) -> list[list[str]]:
+    """Splits words into `chunks` sections whose sizes differ by at most one,
+    larger sections first (the same split as numpy.array_split)"""
+    size, extra = divmod(len(words), chunks)
+    sections, start = [], 0
+    for i in range(chunks):
+        end = start + size + (i < extra)
+        sections.append(words[start:end])
+        start = end
+    return sections
+
 @dataclass
 class File:
     entity: str
@@ -14,12 +41,12 @@ class File:
 
     def file_name(self) -> str:
         if result := self.name:
-            return result 
+            return result
         elif result := self.file_path:
             return result.split('/')[-1]
         else:
             return f"{self.entity}_{self.category}.pdf"
-    
+
     def read_file(self) -> None:
         self.reader = PdfReader(
             BytesIO(self.file_data)
@@ -31,24 +58,56 @@ class File:
     def read_and_chunk(self, chunks: int) -> list[str]:
         """
         Reads in an entire file and splits the text into equal
-        sections (chunks) per page 
+        sections (chunks) per page
 
         Returns: a list of text sections
         """
+        return list(self.iter_chunks(chunks))
+
+    def iter_chunks(self, chunks: int) -> Iterator[str]:
+        """
+        Yields the same text sections as `read_and_chunk`, in page order, as pages are extracted
+
+        Page text is extracted in a process pool, `PAGES_PER_TASK` pages per task,
+        with at most two tasks per worker waiting to be consumed, so memory use
+        doesn't grow with the size of the document
+        """
         self.read_file()
-        text_by_page = [page.extract_text() for page in self.reader.pages]
-        text_by_page_split = []
-        prefix = np.array([self.entity, self.category])
-        for page in text_by_page:
-            # make sure special unicode characters are removed
-            page = np.array(page.encode('ascii','ignore').decode().split()) 
-            split_string = [
-                " ".join(np.concatenate((prefix,section)))
-                for section in np.array_split(page,chunks)
-            ]
-            text_by_page_split.extend(list(split_string))
-
-        return text_by_page_split
+        page_ranges = [
+            (first, min(first + PAGES_PER_TASK, self.num_pages))
+            for first in range(0, self.num_pages, PAGES_PER_TASK)
+        ]
+        workers = min(EXTRACT_WORKERS, len(page_ranges))
+        if workers <= 1:
+            for page in self.reader.pages:
+                yield from self._chunk_page(page.extract_text(), chunks)
+            return
+
+        source = self.file_data if self.file_data else self.file_path
+        # spawn rather than fork: this runs from a threaded server process
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_open_reader,
+            initargs=(source,)
+        ) as executor:
+            in_flight = deque()
+            for page_range in page_ranges:
+                in_flight.append(executor.submit(_extract_pages, *page_range))
+                if len(in_flight) < 2 * workers:
+                    continue
+                for page in in_flight.popleft().result():
+                    yield from self._chunk_page(page, chunks)
+            while in_flight:
+                for page in in_flight.popleft().result():
+                    yield from self._chunk_page(page, chunks)
+
+    def _chunk_page(self, page: str, chunks: int) -> Iterator[str]:
+        prefix = [self.entity, self.category]
+        # make sure special unicode characters are removed
+        words = page.encode('ascii','ignore').decode().split()
+        for section in split_evenly(words, chunks):
+            yield " ".join(prefix + section)
 
     def add_embedding(self, embedding: list[float]) -> None:
-        self.embedding = embedding
\ No newline at end of file
+        self.embedding = embedding
@@ -13,7 +13,7 @@ class AIResponse(BaseModel):
     response: str
 
 @chat.post('')
-async def send_query(query: Query, ai: AI=Depends(get_ai)) -> AIResponse:
+def send_query(query: Query, ai: AI=Depends(get_ai)) -> AIResponse:
     # NOTE: since OpenAI switched to pre-payment, and I haven't set it
     #       up yet, this service is not going to work
     raise HTTPException(status_code=503)
@@ -1,18 +1,52 @@
 import os
 from ai.db.db import db
 from ai.ai.ai import AI
+from data.data.metrics import Collected
 
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL')
 GPT_MODEL = os.getenv('GPT_MODEL')
 
+# shared by every request, connections are pooled behind the db object
+database = db(connection=os.getenv('DATABASE_URL'))
+ai = AI(
+    embedding_model_name=EMBEDDING_MODEL,
+    gpt_model_name=GPT_MODEL,
+    database=database
+)
+
+
+def _pool_connections() -> dict[tuple[str, ...], float]:
+    stats = database.pool.stats()
+    return {("in_use",): stats["in_use"], ("idle",): stats["idle"]}
+
+
+# served on /metrics by whichever app includes the ai router
+Collected(
+    "ai_db_pool_connections",
+    "ai database connections checked out of the pool, or idle in it",
+    collect=_pool_connections,
+    labels=("state",),
+)
+Collected(
+    "ai_db_pool_capacity",
+    "ai database connections the pool may have open at once",
+    collect=lambda: {(): database.pool.size},
+)
+Collected(
+    "ai_db_pool_checkouts_total",
+    "Connections handed out by the ai database pool",
+    collect=lambda: {(): database.pool.checkouts},
+    kind="counter",
+)
+Collected(
+    "ai_db_pool_replaced_total",
+    "ai database connections closed for being dead, expired or broken",
+    collect=lambda: {(): database.pool.replaced},
+    kind="counter",
+)
+
 def get_ai():
-    database = db(connection=os.getenv('DATABASE_URL'))
-    yield AI(
-        embedding_model_name=EMBEDDING_MODEL,
-        gpt_model_name=GPT_MODEL,
-        database=database
-    )
+    yield ai
 
 def get_db():
-    database = db(connection=os.getenv('DATABASE_URL'))
-    yield database
\ No newline at end of file
+    yield database
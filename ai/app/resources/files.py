@@ -1,5 +1,6 @@
 from ai.app.resources.dependencies import get_ai, get_db
 from ai.ai.ai import AI
+from ai.ai.index import file_index
 from ai.db.db import db
 from ai.app.file_handler import File as FileHandler
 from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
@@ -36,6 +37,8 @@ class OneFileRespose(BaseModel):
     data: FileFullRecord
 
 files = APIRouter(prefix='/files')
+# routes that use the database are plain functions, so FastAPI runs them on its
+# threadpool and a wait for a pooled connection never holds up the event loop
 
 
 @files.post('')
@@ -57,7 +60,7 @@ def add_file_task(file: FileHandler, ai: AI) -> None:
    ai.save_embeddings(embeddings_table)
 
 @files.get('')
-async def get_files(db: db=Depends(get_db)) -> FilesResponse:
+def get_files(db: db=Depends(get_db)) -> FilesResponse:
     result = {
         'data':{
             'type': 'files',
@@ -70,7 +73,7 @@ async def get_files(db: db=Depends(get_db)) -> FilesResponse:
     return result
 
 @files.get('/{file_id}')
-async def get_file(file_id: int, db: db=Depends(get_db)) -> OneFileRespose:
+def get_file(file_id: int, db: db=Depends(get_db)) -> OneFileRespose:
     with db as session:
         filedf = session.get_files(file_id=file_id)
         if filedf.empty:
@@ -93,6 +96,7 @@ async def get_file(file_id: int, db: db=Depends(get_db)) -> OneFileRespose:
     return result
 
 @files.delete('/{file_id}')
-async def delete_file(file_id: int, db: db=Depends(get_db)) -> None:
+def delete_file(file_id: int, db: db=Depends(get_db)) -> None:
     with db as session:
-        return session.del_file(file_id=file_id)
\ No newline at end of file
+        session.del_file(file_id=file_id)
+    file_index.remove(file_id)
\ No newline at end of file
@@ -1,34 +1,117 @@
 import os
-import requests
+import re
+import time
+import asyncio
+import httpx
+from typing import Callable
+from logging import getLogger
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer
-from jose.jwt import get_unverified_header, decode 
+from jose import jwk
+from jose.backends.base import Key
+from jose.jwt import get_unverified_header, decode
+
+logger = getLogger("uvicorn.info")
 
 token_auth_scheme = HTTPBearer()
 AUTH0_DOMAIN = os.getenv('AUTH0_DOMAIN')
 ALGORITHMS = os.getenv('ALGORITHMS')
 AUDIENCE = os.getenv('AUDIENCE')
+JWKS_MAX_AGE = float(os.getenv('JWKS_MAX_AGE', 10*60))
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv('JWKS_MIN_REFRESH_INTERVAL', 30))
+
+
+class JWKSCache:
+    """
+    Signing keys from the JWKS endpoint, parsed into key objects once and kept by kid.
+
+    The set is kept for as long as the endpoint's Cache-Control max-age allows
+    (`default_max_age` without one). After that, the cached keys are still
+    used while a refresh runs in the background. A token with an unknown kid
+    (a key rotation) forces one refresh. Refreshes of any kind happen at most
+    once per `min_refresh_interval` seconds, so a stream of bad tokens can't
+    hammer the endpoint. `clock` gives the time, in seconds.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            default_max_age: float = JWKS_MAX_AGE,
+            min_refresh_interval: float = JWKS_MIN_REFRESH_INTERVAL,
+            clock: Callable[[], float] = time.monotonic
+        ) -> None:
+        self.url = url
+        self.default_max_age = default_max_age
+        self.min_refresh_interval = min_refresh_interval
+        self.clock = clock
+        self.keys: dict[str, Key] = {}
+        self.expires = 0.0
+        self._last_refresh = float("-inf")
+        self._refreshing: asyncio.Task | None = None
+
+    async def get_key(self, kid: str) -> Key | None:
+        now = self.clock()
+        may_refresh = now - self._last_refresh >= self.min_refresh_interval
+        # a failed first fetch is rate limited like any other, but a fetch
+        # already under way is always worth waiting for
+        in_flight = self._refreshing is not None and not self._refreshing.done()
+        if kid not in self.keys and (may_refresh or in_flight):
+            await self.refresh()
+        elif now >= self.expires and may_refresh:
+            self.refresh_in_background()
+        return self.keys.get(kid)
+
+    async def refresh(self) -> None:
+        """Fetch the key set, joining a refresh that is already under way"""
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch())
+        try:
+            await asyncio.shield(self._refreshing)
+        except Exception as err:
+            logger.error(f"JWKS refresh failed: {err}")
+
+    def refresh_in_background(self) -> None:
+        if self._refreshing is None or self._refreshing.done():
+            self._refreshing = asyncio.create_task(self._fetch())
+            self._refreshing.add_done_callback(self._log_failure)
+
+    @staticmethod
+    def _log_failure(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception():
+            logger.error(f"JWKS refresh failed: {task.exception()}")
+
+    async def _fetch(self) -> None:
+        self._last_refresh = self.clock()
+        async with httpx.AsyncClient(timeout=10) as client:
+            response = await client.get(self.url)
+        response.raise_for_status()
+        keys = {}
+        for key in response.json()["keys"]:
+            try:
+                keys[key["kid"]] = jwk.construct(key, key.get("alg", "RS256"))
+            except Exception as err:
+                logger.warning(f"skipping JWKS key {key.get('kid')}: {err}")
+        self.keys = keys
+        self.expires = self.clock() + self._max_age(response.headers.get("cache-control"))
+
+    def _max_age(self, cache_control: str | None) -> float:
+        if cache_control and (max_age := re.search(r"max-age=(\d+)", cache_control)):
+            return float(max_age.group(1))
+        return self.default_max_age
+
+
+jwks = JWKSCache(f"{AUTH0_DOMAIN}/.well-known/jwks.json")
 
 async def authenticate_auth0_token(token: str = Depends(token_auth_scheme)):
     error = None
     token_cred = token.credentials
 
-    jwks = requests.get(AUTH0_DOMAIN+"/.well-known/jwks.json").json()
     try:
         unverified_header = get_unverified_header(token_cred)
     except Exception as err:
         error = err
     else:
-        rsa_key = {}
-        for key in jwks["keys"]:
-            if key["kid"] == unverified_header.get("kid"):
-                rsa_key = {
-                    "kty": key["kty"],
-                    "kid": key["kid"],
-                    "use": key["use"],
-                    "n": key["n"],
-                    "e": key["e"]             
-                }
+        rsa_key = await jwks.get_key(unverified_header.get("kid"))
         if rsa_key:
             try:
                 payload = decode(
@@ -44,4 +127,3 @@ async def authenticate_auth0_token(token: str = Depends(token_auth_scheme)):
         else:
             error = "No RSA key found in JWT Header"
     raise HTTPException(status_code=401, detail=str(error))
-
@@ -2,24 +2,175 @@
 embeddings, and CRUD on entities that surround
 the reference files"""
 
+import os
+import threading
+import time
+from typing import Callable
 import psycopg2 as pg
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.pool import PoolError
 import pandas as pd
 from datetime import datetime
 
+POOL_SIZE = int(os.getenv("AI_DB_POOL_SIZE", 10))
+POOL_TIMEOUT = float(os.getenv("AI_DB_POOL_TIMEOUT", 30))
+POOL_MAX_LIFETIME = float(os.getenv("AI_DB_POOL_MAX_LIFETIME", 30 * 60))
+POOL_CHECK_IDLE = float(os.getenv("AI_DB_POOL_CHECK_IDLE", 30))
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections to one database.
+
+    At most `size` connections are open. Checkout blocks, for up to `timeout`
+    seconds, while all of them are in use. A connection is closed and replaced
+    instead of being reused once it is older than `max_lifetime` seconds, or if
+    it fails a `SELECT 1` after sitting idle for more than `check_idle` seconds.
+    `connect` opens a new connection to the DSN and `clock` gives the time.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        size: int = POOL_SIZE,
+        timeout: float = POOL_TIMEOUT,
+        max_lifetime: float = POOL_MAX_LIFETIME,
+        check_idle: float = POOL_CHECK_IDLE,
+        connect: Callable = pg.connect,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.dsn = dsn
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self.connect = connect
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        # (connection, opened at, idle since), most recently returned last
+        self._idle: list[tuple] = []
+        self._opened_at: dict[int, float] = {}
+        self.in_use = 0
+        self.checkouts = 0
+        self.replaced = 0
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolError(f"no database connection free after {self.timeout}s")
+        try:
+            conn = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+        return conn
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                idle = self._idle.pop() if self._idle else None
+            if idle is None:
+                conn = self.connect(self.dsn)
+                self._opened_at[id(conn)] = self.clock()
+                return conn
+            conn, opened_at, idle_since = idle
+            if self._healthy(conn, opened_at, idle_since):
+                return conn
+            self._discard(conn)
+
+    def _healthy(self, conn, opened_at: float, idle_since: float) -> bool:
+        now = self.clock()
+        if conn.closed or now - opened_at > self.max_lifetime:
+            return False
+        if now - idle_since > self.check_idle:
+            try:
+                with conn.cursor() as curr:
+                    curr.execute("SELECT 1;")
+                conn.rollback()
+            except pg.Error:
+                return False
+        return True
+
+    def putconn(self, conn) -> None:
+        try:
+            if not conn.closed and (
+                conn.get_transaction_status() != TRANSACTION_STATUS_IDLE
+            ):
+                conn.rollback()
+            opened_at = self._opened_at.get(id(conn), 0)
+            if conn.closed or self.clock() - opened_at > self.max_lifetime:
+                self._discard(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, opened_at, self.clock()))
+        except pg.Error:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+
+    def _discard(self, conn) -> None:
+        self._opened_at.pop(id(conn), None)
+        self.replaced += 1
+        try:
+            conn.close()
+        except pg.Error:
+            pass
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                "size": self.size,
+                "open": self.in_use + len(self._idle),
+                "in_use": self.in_use,
+                "idle": len(self._idle),
+                "checkouts": self.checkouts,
+                "replaced": self.replaced,
+            }
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(dsn: str) -> ConnectionPool:
+    """The process-wide pool for `dsn`"""
+    with _pools_lock:
+        if dsn not in _pools:
+            _pools[dsn] = ConnectionPool(dsn)
+        return _pools[dsn]
+
 
 class db:
+    """
+    Connections come from the process-wide pool for the DSN and are held
+    per thread for the length of a `with` block, so one instance can be
+    shared across requests.
+    """
 
     def __init__(self, connection: str):
         self.connection = connection
+        self.pool = get_pool(connection)
+        self._local = threading.local()
+
+    @property
+    def conn(self):
+        return self._local.conns[-1]
 
     def __enter__(self):
-        self.conn = pg.connect(self.connection)
+        if not hasattr(self._local, "conns"):
+            self._local.conns = []
+        self._local.conns.append(self.pool.getconn())
         return self
 
     def __exit__(self, e_type, e_val, e_tb):
+        self.close()
         if e_tb:
             return False
-        self.close()
         return True
 
     def get_embeddings(self, file_id: int | list[int] = None) -> pd.DataFrame:
@@ -148,7 +299,8 @@ class db:
                 curr.execute(sql_del_embeddings, (file_id,))
                 curr.execute(sql_del_file, (file_id,))
 
-    def del_entity(self, entity_id: int):
+    def del_entity(self, entity_id: int) -> list[int]:
+        """Deletes the entity with its files, returning the deleted file ids"""
         with self.conn:
             with self.conn.cursor() as curr:
                 sub_query = """
@@ -160,10 +312,15 @@ class db:
                 """
                 sql = f"DELETE FROM embeddings WHERE file_id IN ({sub_query});"
                 curr.execute(sql, (entity_id,))
-                sql_del_files = f"DELETE FROM files WHERE id IN ({sub_query})"
+                sql_del_files = (
+                    f"DELETE FROM files WHERE id IN ({sub_query}) RETURNING id;"
+                )
                 curr.execute(sql_del_files, (entity_id,))
+                file_ids = [row[0] for row in curr.fetchall()]
                 sql_del_entity = "DELETE FROM entities WHERE id = %s;"
                 curr.execute(sql_del_entity, (entity_id,))
+        return file_ids
 
     def close(self):
-        self.conn.close()
+        """return the connection to the pool"""
+        self.pool.putconn(self._local.conns.pop())
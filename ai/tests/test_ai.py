@@ -1,33 +1,51 @@
 from ai.ai.ai import AI
-from random import random, randint
+from random import random, randint, shuffle
+from time import sleep
+from zlib import crc32
 from ai.app.resources.dependencies import EMBEDDING_MODEL, GPT_MODEL
 import pandas as pd
 from ai.app.file_handler import File
 from ai.db.db import db
 from os import getenv
 
+def text_marker(text: str) -> float:
+    return float(crc32(text.encode()))
+
 class TestAI(AI):
 
     __test__ = False
 
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.embedding_requests: list[int] = []
+
     def _create_embedding(self, text):
         """override to fake call to OpenAI
         The structure of the embedding matches tne expected response from OpenAI,
-        but the embedding values are randomly generated
+        but the embedding values are randomly generated, except for the first value,
+        which is derived from the input text so tests can check embeddings stay matched
+        to their text. Batched input comes back with the data entries shuffled
+        and after a random delay, so ordering has to come from each entry's index
         """
-
+        inputs = [text] if isinstance(text, str) else text
+        self.embedding_requests.append(len(inputs))
+        data = [
+            {
+                'object': 'embedding',
+                'embedding': [text_marker(input_text)] + [
+                    (random()*(10**-(randint(2,3))))*((-1)**randint(1,2))
+                    for i in range(1535)
+                ],
+                'index': i
+            }
+            for i, input_text in enumerate(inputs)
+        ]
+        if len(inputs) > 1:
+            shuffle(data)
+            sleep(random()/100)
         embedding = {
             'object': 'list',
-            'data': [
-                {
-                    'object': 'embedding',
-                    'embedding': [
-                        (random()*(10**-(randint(2,3))))*((-1)**randint(1,2))
-                        for i in range(1536)
-                    ],
-                    'index': 0
-                }
-            ],
+            'data': data,
             'model': EMBEDDING_MODEL,
             'usage': {
                 'prompt_tokens': 99999,
@@ -94,6 +112,19 @@ def test_generate_embeddings_table():
         for file_id in file_ids:
             delete_data(database=database, file_id=file_id)
 
+def test_embed_segments():
+    segments = [f"segment {i} " + "word " * randint(1, 200) for i in range(300)]
+    ai = TestAI(EMBEDDING_MODEL, GPT_MODEL, None,
+                embedding_batch_tokens=1000, embedding_batch_size=20,
+                embedding_concurrency=4)
+    texts, embeddings = ai.embed_segments(segments)
+    # segments were packed into several batches, none over the size limit
+    assert 1 < len(ai.embedding_requests) < len(segments)
+    assert max(ai.embedding_requests) <= 20
+    # every segment comes back once, in order, alongside its own embedding
+    assert texts == segments
+    assert [embedding[0] for embedding in embeddings] == [text_marker(text) for text in texts]
+
 def test__register_file_with_the_database():
     database = db(connection=getenv('DATABASE_URL'))
     file_path = '/home/carboni/projects/hvac-cs-ai/5e133f6d27f35743210648.pdf'
@@ -0,0 +1,23 @@
+import asyncio
+
+from ai.auth.auth import JWKSCache
+
+
+def test_failed_fetches_are_rate_limited_with_no_keys(monkeypatch):
+    fetches = []
+
+    async def failing_fetch(self) -> None:
+        self._last_refresh = 0.0
+        fetches.append(self._last_refresh)
+        raise OSError("JWKS endpoint unreachable")
+
+    monkeypatch.setattr(JWKSCache, "_fetch", failing_fetch)
+    cache = JWKSCache(
+        "https://example.invalid/jwks.json", min_refresh_interval=30, clock=lambda: 10.0
+    )
+
+    async def requests():
+        return [await cache.get_key("kid") for _ in range(5)]
+
+    assert asyncio.run(requests()) == [None] * 5
+    assert len(fetches) == 1
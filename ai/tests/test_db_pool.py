@@ -0,0 +1,161 @@
+import threading
+
+import psycopg2 as pg
+import pytest
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE, TRANSACTION_STATUS_INERROR
+from psycopg2.pool import PoolError
+
+from ai.db.db import ConnectionPool
+
+
+class FakeCursor:
+    def __init__(self, conn: "FakeConnection") -> None:
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql: str, params=None) -> None:
+        self.conn.executed.append(sql)
+        if self.conn.dead:
+            raise pg.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.closed = 0
+        self.dead = False
+        self.status = TRANSACTION_STATUS_IDLE
+        self.executed: list[str] = []
+        self.rollbacks = 0
+
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+
+    def get_transaction_status(self) -> int:
+        return self.status
+
+    def rollback(self) -> None:
+        self.rollbacks += 1
+        self.status = TRANSACTION_STATUS_IDLE
+
+    def close(self) -> None:
+        self.closed = 1
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def pool(**options) -> tuple[ConnectionPool, list[FakeConnection], Clock]:
+    opened = []
+    clock = Clock()
+
+    def connect(dsn: str) -> FakeConnection:
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    options = {"size": 2, "timeout": 1, "max_lifetime": 60, "check_idle": 10} | options
+    return ConnectionPool("dsn", connect=connect, clock=clock, **options), opened, clock
+
+
+def test_returned_connections_are_reused():
+    connections, opened, _ = pool()
+
+    first = connections.getconn()
+    assert connections.stats()["in_use"] == 1
+    connections.putconn(first)
+    assert connections.getconn() is first
+    second = connections.getconn()
+
+    assert opened == [first, second]
+    assert connections.stats() == {
+        "size": 2,
+        "open": 2,
+        "in_use": 2,
+        "idle": 0,
+        "checkouts": 3,
+        "replaced": 0,
+    }
+
+
+def test_open_transaction_is_rolled_back_on_return():
+    connections, _, _ = pool()
+    conn = connections.getconn()
+    conn.status = TRANSACTION_STATUS_INERROR
+
+    connections.putconn(conn)
+
+    assert conn.rollbacks == 1
+    assert connections.getconn() is conn
+
+
+def test_connection_past_its_lifetime_is_replaced():
+    connections, opened, clock = pool()
+    old = connections.getconn()
+    clock.now += 61
+
+    # too old to go back into the pool
+    connections.putconn(old)
+    new = connections.getconn()
+
+    assert new is not old and old.closed
+    assert opened == [old, new]
+    assert connections.stats()["replaced"] == 1
+
+
+def test_dead_idle_connection_is_replaced():
+    connections, opened, clock = pool()
+    conn = connections.getconn()
+    connections.putconn(conn)
+
+    # idle for less than check_idle: handed out without a check
+    clock.now += 5
+    assert connections.getconn() is conn
+    assert conn.executed == []
+    connections.putconn(conn)
+
+    conn.dead = True
+    clock.now += 11
+    replacement = connections.getconn()
+
+    assert conn.executed == ["SELECT 1;"] and conn.closed
+    assert replacement is opened[1]
+    assert connections.stats()["replaced"] == 1
+
+
+def test_checkout_times_out_when_the_pool_is_exhausted():
+    connections, opened, _ = pool(size=1, timeout=0.05)
+    held = connections.getconn()
+
+    with pytest.raises(PoolError):
+        connections.getconn()
+    assert len(opened) == 1
+    assert connections.stats()["in_use"] == 1
+
+    # a waiting checkout gets the connection as soon as it is returned
+    threading.Timer(0.01, connections.putconn, (held,)).start()
+    connections.timeout = 1
+    assert connections.getconn() is held
+
+
+def test_failed_connect_frees_its_slot():
+    connections, _, _ = pool(size=1, timeout=0.05)
+
+    def refused(dsn: str):
+        raise pg.OperationalError("connection refused")
+
+    connections.connect = refused
+    with pytest.raises(pg.OperationalError):
+        connections.getconn()
+
+    connections.connect = lambda dsn: FakeConnection()
+    assert connections.getconn() is not None
+    assert connections.stats()["in_use"] == 1
@@ -1,20 +1,27 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import asyncio
+import time
 from os import getenv
 from datetime import datetime, UTC
 from contextlib import asynccontextmanager
 
-from fastapi import FastAPI, Request, Response, Depends
+from fastapi import FastAPI, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-
-from sqlalchemy import text
-from sqlalchemy.orm import Session
+from fastapi.responses import PlainTextResponse
 
 from data.routes import fred, cdd
+from data.data.http_client import upstream
+from data.data.climate_prediction_center import backfill_snapshots
+from data.data.snapshots import parse_years
+from data.data.reference import get_reference_data
+from data.data.metrics import Collected, render, request_seconds, timed
 from testing.mspa import mspa
-from api_access_gate import access_gate, access_keys
-from db import get_db
+from db import DB_MAX_OVERFLOW, DB_POOL_SIZE, db_executor, engine, pool_options
+from api_access_gate import access_gate, access_keys, last_used, metrics_gate
+from request_log import request_log
+from prefetch import PREFETCH_ENABLED, prefetcher
 from logging import getLogger
 
 logger = getLogger("uvicorn.info")
@@ -23,30 +30,28 @@ logger = getLogger("uvicorn.info")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting lifespan")
-    # setup access keys
-    global access_keys
-    db: Session = next(get_db())
-    try:
-        logger.info("Setting up access keys")
-        sql = """
-            SELECT id, keyhash, expires, revoked
-            FROM data_api_access_keys
-            WHERE NOT revoked
-            AND (expires IS NULL OR expires > :now)
-        """
-        response = (
-            db.execute(text(sql), params=dict(now=datetime.now(UTC)))
-            .mappings()
-            .fetchall()
-        )
-        if response:
-            access_keys.setup_keystore(records=response)
-    except Exception as e:
-        logger.error(e)
-    finally:
-        db.close()
+    logger.info("Setting up access keys")
+    # reloaded in the background from here on
+    await access_keys.start()
+    # read once here rather than on the first /cdd request
+    get_reference_data()
+    await upstream.start()
+    await request_log.start()
+    await last_used.start()
+    backfill = None
+    if years := getenv("CPC_SNAPSHOT_BACKFILL"):
+        # e.g. "2015-2024", runs in the background so startup isn't held up
+        backfill = asyncio.create_task(backfill_snapshots(parse_years(years)))
+    if PREFETCH_ENABLED:
+        await prefetcher.start()
     yield
-    # teardown logic would go here
+    await prefetcher.stop()
+    if backfill:
+        backfill.cancel()
+    await last_used.stop()
+    await access_keys.stop()
+    await request_log.stop()
+    await upstream.close()
 
 
 app = FastAPI(title="Carboni Tech API", version="0.3.1", lifespan=lifespan)
@@ -65,36 +70,86 @@ app.add_middleware(
 )
 
 
+def _pool_connections() -> dict[tuple[str, ...], float]:
+    pool = engine.pool
+    # only QueuePool (everything but sqlite) counts its connections
+    if not hasattr(pool, "checkedout"):
+        return {}
+    return {("checked_out",): pool.checkedout(), ("idle",): pool.checkedin()}
+
+
+Collected(
+    "data_api_db_pool_connections",
+    "Database connections checked out of the pool, or idle in it",
+    collect=_pool_connections,
+    labels=("state",),
+)
+Collected(
+    "data_api_db_pool_capacity",
+    "Connections the pool may hand out at once (pool size plus overflow)",
+    collect=lambda: (
+        {(): DB_POOL_SIZE + DB_MAX_OVERFLOW} if "pool_size" in pool_options else {}
+    ),
+)
+Collected(
+    "data_api_db_executor_tasks",
+    "Database calls running on a database thread, or waiting for one",
+    collect=lambda: {
+        ("running",): db_executor.running,
+        ("queued",): db_executor.queued,
+    },
+    labels=("state",),
+)
+
+
+Collected(
+    "data_api_request_log_queued",
+    "Request log rows waiting to be written",
+    collect=lambda: {(): request_log.queue.qsize() if request_log.queue else 0},
+)
+Collected(
+    "data_api_request_log_dropped_total",
+    "Request log rows dropped because the queue was full",
+    collect=lambda: {(): request_log.dropped},
+    kind="counter",
+)
+
+
+# separate from the access keys: a scraper gets the metrics token, not a key
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(metrics_gate)])
+async def metrics():
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
 # middleware for recording all API calls
 @app.middleware("http")
 async def record_api_call(request: Request, call_next):
-    db: Session = next(get_db())
-    sql = """
-        INSERT INTO data_api_request_log (agent, path, parameters, ip, time) 
-        VALUES (:a, :b, :c, :d, :e);
-    """
-    response = Response("Internal server error", status_code=500)
+    start = time.perf_counter()
+    # rows are queued here and written in batches by request_log's worker
     try:
-        time = datetime.now(UTC)
-        user_agent = request.headers.get("user-agent")
-        parameters = str(request.query_params)
-        host, port = request.client
-        path = request.url.path
-
-        db.execute(
-            text(sql),
-            params={
-                "a": user_agent,
-                "b": path,
-                "c": parameters,
-                "d": host + ":" + str(port),
-                "e": time,
-            },
-        )
-        db.commit()
+        with timed("request_log"):
+            host, port = request.client
+            await request_log.record(
+                {
+                    "agent": request.headers.get("user-agent"),
+                    "path": request.url.path,
+                    "parameters": str(request.query_params),
+                    "ip": host + ":" + str(port),
+                    "time": datetime.now(UTC),
+                }
+            )
     except Exception as e:
         import traceback
 
         traceback.print_exc(e)
     finally:
-        return await call_next(request)
+        response = await call_next(request)
+        # the route template, so the label doesn't grow with every distinct path
+        route = request.scope.get("route")
+        request_seconds.observe(
+            time.perf_counter() - start,
+            request.method,
+            route.path if route else "unmatched",
+            str(response.status_code),
+        )
+        return response
@@ -1,13 +1,31 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import asyncio
 import hashlib
+import secrets
+import select
+from collections import OrderedDict
+from os import getenv
 from datetime import datetime, UTC
+from types import MappingProxyType
 from fastapi import HTTPException, Header
 from sqlalchemy import text
 from sqlalchemy.orm import Session
-from typing import Any
-from db import get_db
+from typing import Any, Mapping
+from logging import getLogger
+from db import engine, get_db, run_in_db
+from data.data.metrics import timed
+
+logger = getLogger("uvicorn.info")
+
+LAST_USED_FLUSH_INTERVAL = float(getenv("LAST_USED_FLUSH_INTERVAL", 30))
+ACCESS_KEYS_REFRESH_INTERVAL = float(getenv("ACCESS_KEYS_REFRESH_INTERVAL", 60))
+# set to have a Postgres NOTIFY on this channel reload the keys right away
+ACCESS_KEYS_NOTIFY_CHANNEL = getenv("ACCESS_KEYS_NOTIFY_CHANNEL")
+ACCESS_KEYS_MEMO_SIZE = int(getenv("ACCESS_KEYS_MEMO_SIZE", 1024))
+# the bearer token a scraper sends for /metrics, which is off without one
+METRICS_TOKEN = getenv("METRICS_TOKEN")
 
 
 # On key creation
@@ -15,51 +33,260 @@ def hash_api_key(api_key: str) -> str:
     return hashlib.sha256(api_key.encode()).hexdigest()
 
 
+class KeyChangeListener:
+    """
+    LISTEN on a Postgres channel, over a connection of its own, for a NOTIFY
+    sent when data_api_access_keys changes (e.g. from a trigger)
+    """
+
+    def __init__(self, channel: str) -> None:
+        fairy = engine.raw_connection()
+        # kept out of the pool, it is held for as long as the app runs
+        fairy.detach()
+        self.connection = fairy.driver_connection
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{channel}"')
+
+    def wait(self, timeout: float) -> bool:
+        """whether a notification arrived within `timeout` seconds"""
+        if select.select([self.connection], [], [], timeout) == ([], [], []):
+            return False
+        self.connection.poll()
+        notified = bool(self.connection.notifies)
+        self.connection.notifies.clear()
+        return notified
+
+    def close(self) -> None:
+        self.connection.close()
+
+
 class AccessKeys:
+    """
+    Snapshot of the usable access keys, keyhash -> record, reloaded from the
+    database every `refresh_interval` seconds (or on NOTIFY) and swapped in
+    whole, so a request sees either the old set of keys or the new one.
+    Raw keys already seen are remembered against their record, for lookups
+    that skip hashing; the memo belongs to a snapshot and goes with it.
+    """
 
-    def __init__(self) -> None:
-        self.keys: dict[str, dict[str, Any]] = {}
+    def __init__(
+        self,
+        refresh_interval: float = ACCESS_KEYS_REFRESH_INTERVAL,
+        notify_channel: str | None = ACCESS_KEYS_NOTIFY_CHANNEL,
+        memo_size: int = ACCESS_KEYS_MEMO_SIZE,
+    ) -> None:
+        self.refresh_interval = refresh_interval
+        self.notify_channel = notify_channel
+        self.memo_size = memo_size
+        self.keys: Mapping[str, Mapping[str, Any]] = MappingProxyType({})
+        self._memo: OrderedDict[str, Mapping[str, Any]] = OrderedDict()
+        self._listener: KeyChangeListener | None = None
+        self._worker: asyncio.Task | None = None
 
     def setup_keystore(self, records: list[dict[str, Any]]) -> None:
-        self.keys = {
-            record["keyhash"]: {k: v for k, v in record.items() if k != "keyhash"}
-            for record in records
-        }
+        self.keys = MappingProxyType(
+            {
+                record["keyhash"]: MappingProxyType(
+                    {k: v for k, v in record.items() if k != "keyhash"}
+                )
+                for record in records
+            }
+        )
+        self._memo = OrderedDict()
 
-    def valid_key(self, key) -> bool:
-        if not self.keys:
-            return False
-        incoming_keyhash = hash_api_key(key)
-        stored_key = self.keys.get(incoming_keyhash, None)
-        if not stored_key or stored_key["revoked"]:
-            return False
+    def lookup(self, key: str) -> Mapping[str, Any] | None:
+        """The stored record for the raw `key`, or None if it isn't usable"""
+        memo = self._memo
+        stored_key = memo.get(key)
+        if stored_key is None:
+            stored_key = self.keys.get(hash_api_key(key))
+            if not stored_key or stored_key["revoked"]:
+                return None
+            memo[key] = stored_key
+            if len(memo) > self.memo_size:
+                memo.popitem(last=False)
+        else:
+            memo.move_to_end(key)
         expiry = stored_key["expires"]
-        return expiry is None or expiry > datetime.now(UTC)
+        if expiry is not None and expiry <= datetime.now(UTC):
+            return None
+        return stored_key
 
+    def valid_key(self, key) -> bool:
+        return self.lookup(key) is not None
 
-async def access_gate(x_access_key: str = Header(None)):
-    if not x_access_key:
-        raise HTTPException(status_code=401, detail="Missing API key")
+    async def start(self) -> None:
+        """Load the keys, then keep reloading them in the background"""
+        await self.refresh()
+        if not self._worker:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        if self._listener:
+            self._listener.close()
+            self._listener = None
+
+    async def refresh(self) -> None:
+        """Swap in the keys currently in the database; on failure the
+        current keys stay in use"""
+        try:
+            records = await run_in_db(self._read)
+        except Exception as e:
+            logger.error(f"failed to load access keys: {e}")
+            return
+        self.setup_keystore(records)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.notify_channel and not self._listener:
+                self._listen()
+            due = loop.time() + self.refresh_interval
+            while self._listener and loop.time() < due:
+                # short waits, so stopping never holds on to a thread for long
+                timeout = min(due - loop.time(), 5)
+                try:
+                    if await asyncio.to_thread(self._listener.wait, timeout):
+                        break
+                except Exception as e:
+                    logger.warning(f"stopped listening for access key changes: {e}")
+                    self._listener.close()
+                    self._listener = None
+            else:
+                await asyncio.sleep(max(due - loop.time(), 0))
+            await self.refresh()
+
+    def _listen(self) -> None:
+        if engine.dialect.name != "postgresql":
+            logger.warning("ACCESS_KEYS_NOTIFY_CHANNEL needs Postgres, polling instead")
+            self.notify_channel = None
+            return
+        try:
+            self._listener = KeyChangeListener(self.notify_channel)
+        except Exception as e:
+            logger.warning(f"could not listen for access key changes: {e}")
+
+    @staticmethod
+    def _read() -> list[dict[str, Any]]:
+        sql = """
+            SELECT id, keyhash, expires, revoked
+            FROM data_api_access_keys
+            WHERE NOT revoked
+            AND (expires IS NULL OR expires > :now)
+        """
+        db: Session = next(get_db())
+        try:
+            return [
+                dict(record)
+                for record in db.execute(text(sql), params=dict(now=datetime.now(UTC)))
+                .mappings()
+                .fetchall()
+            ]
+        finally:
+            db.close()
+
+
+class LastUsedTracker:
+    """
+    Write-behind record of when each key was last used.
+
+    Authenticated requests only touch an in-memory dict, so repeated use of
+    the same key between flushes collapses into a single timestamp. Every
+    `flush_interval` seconds the pending timestamps are written with one
+    UPDATE statement, which means a key's last_used is at most that many
+    seconds stale.
+    """
+
+    def __init__(self, flush_interval: float = LAST_USED_FLUSH_INTERVAL) -> None:
+        self.flush_interval = flush_interval
+        self.pending: dict[Any, datetime] = {}
+        self._worker: asyncio.Task | None = None
+
+    def touch(self, key_id: Any) -> None:
+        self.pending[key_id] = datetime.now(UTC)
+
+    async def start(self) -> None:
+        if not self._worker:
+            self._worker = asyncio.create_task(self._run())
 
-    if not access_keys.valid_key(x_access_key):
-        raise HTTPException(status_code=401, detail="Invalid API key")
+    async def stop(self) -> None:
+        if self._worker:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
 
-    # Update last_used
-    stored_key = access_keys.keys.get(hash_api_key(x_access_key))
-    if stored_key:
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self) -> None:
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            await run_in_db(self._write, pending)
+        except Exception as e:
+            logger.error(f"failed to update last_used for {len(pending)} keys: {e}")
+            # keep them for the next flush unless the key was used again since
+            for key_id, used in pending.items():
+                self.pending.setdefault(key_id, used)
+
+    @staticmethod
+    def _write(pending: dict[Any, datetime]) -> None:
+        values = ", ".join(f"(:key_id_{i}, :now_{i})" for i in range(len(pending)))
+        sql = f"""
+            UPDATE data_api_access_keys
+            SET last_used = updates.column2
+            FROM (VALUES {values}) AS updates
+            WHERE data_api_access_keys.id = updates.column1
+        """
+        params = {}
+        for i, (key_id, used) in enumerate(pending.items()):
+            params[f"key_id_{i}"] = key_id
+            params[f"now_{i}"] = used
         db: Session = next(get_db())
         try:
-            sql = """
-                UPDATE data_api_access_keys
-                SET last_used = :now
-                WHERE id = :key_id
-            """
-            db.execute(
-                text(sql), {"now": datetime.now(UTC), "key_id": stored_key["id"]}
-            )
+            db.execute(text(sql), params)
             db.commit()
         finally:
             db.close()
 
 
+async def access_gate(x_access_key: str = Header(None)):
+    with timed("access_gate"):
+        if not x_access_key:
+            raise HTTPException(status_code=401, detail="Missing API key")
+
+        stored_key = access_keys.lookup(x_access_key)
+        if stored_key is None:
+            raise HTTPException(status_code=401, detail="Invalid API key")
+
+        # Update last_used, written to the database by last_used's worker
+        last_used.touch(stored_key["id"])
+
+
+async def metrics_gate(authorization: str = Header(None)):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {METRICS_TOKEN}".encode()
+    if not authorization or not secrets.compare_digest(
+        authorization.encode(), expected
+    ):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+
 access_keys = AccessKeys()
+last_used = LastUsedTracker()
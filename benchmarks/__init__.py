@@ -0,0 +1,13 @@
+"""
+Offline benchmarks for the data API.
+
+The app runs in-process, with its lifespan, against local stand-ins:
+an HTTP server that serves generated CPC and FRED files in place of the
+real upstreams, and a SQLite database for the access keys and the request log.
+
+    python -m benchmarks --requests 300 --concurrency 8 --output bench.json
+    python -m benchmarks --compare before.json after.json
+
+Run from the repository root, since the app reads its reference tables
+from ./data.
+"""
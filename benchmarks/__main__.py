@@ -0,0 +1,221 @@
+"""
+Per-endpoint latency percentiles and throughput, written as JSON
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, UTC
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.upstream import serve
+
+ENDPOINTS = {
+    "/cdd": [
+        "states=GA,FL",
+        "states=TX,GA&climate_divisions=true",
+    ],
+    "/cdd/cumulative": [
+        "states=GA,FL",
+        "states=GA,AL&normals=true",
+        "states=FL&climate_divisions=true",
+    ],
+    "/cdd/cumulative-differences": [
+        "states=GA,FL",
+        "states=GA&climate_divisions=true",
+    ],
+    "/fred-data": [
+        "series_id=GANA&fred_api_key=benchmark",
+        "series_id=UNRATE&fred_api_key=benchmark",
+    ],
+    "/fred-data/housing-inventory": [
+        "state=GA&fred_api_key=benchmark",
+    ],
+}
+
+
+def summarize(latencies: list[float], elapsed: float, errors: int) -> dict:
+    """latencies and elapsed in seconds, reported in milliseconds"""
+    ms = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99]).tolist()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "p50_ms": round(p50, 3),
+        "p95_ms": round(p95, 3),
+        "p99_ms": round(p99, 3),
+        "mean_ms": round(float(ms.mean()), 3),
+        "max_ms": round(float(ms.max()), 3),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+    }
+
+
+async def bench_endpoint(
+    client: httpx.AsyncClient,
+    path: str,
+    queries: list[str],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict:
+    """
+    `requests` requests spread over `concurrency` concurrent callers, cycling
+    through `queries`, after `warmup` untimed requests. The latency of the
+    very first request, before anything is cached, is reported on its own
+    """
+    urls = [f"{path}?{query}" for query in queries]
+    start = time.perf_counter()
+    response = await client.get(urls[0])
+    first_request = time.perf_counter() - start
+    if response.status_code != 200:
+        raise RuntimeError(
+            f"{urls[0]} returned {response.status_code}: {response.text[:200]}"
+        )
+    for i in range(warmup):
+        await client.get(urls[i % len(urls)])
+
+    latencies, errors = [], 0
+    counter = itertools.count()
+
+    async def caller() -> None:
+        nonlocal errors
+        while (i := next(counter)) < requests:
+            start = time.perf_counter()
+            response = await client.get(urls[i % len(urls)])
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(caller() for _ in range(concurrency)))
+    result = summarize(latencies, time.perf_counter() - start, errors)
+    return {"queries": queries, "first_request_ms": round(first_request * 1000, 3)} | result
+
+
+async def run(workdir: Path, args: argparse.Namespace) -> dict:
+    upstream_dir = workdir / "upstream"
+    server, base_url = serve(upstream_dir)
+    # the app reads its configuration from the environment when it is imported
+    os.environ.update(
+        ORIGINS="*",
+        DATABASE_URL=f"sqlite:///{workdir / 'benchmark.db'}",
+        CPC_BASE_URL=f"{base_url}/cpc/",
+        FRED_ROOT_URL=f"{base_url}/fred",
+        CPC_SNAPSHOT_DIR=str(workdir / "snapshots"),
+        # so first requests are still measured cold
+        PREFETCH_ENABLED="false",
+    )
+    from benchmarks import fixtures
+
+    fixtures.write_upstream_fixtures(upstream_dir, seed=args.seed)
+    fixtures.write_database(workdir / "benchmark.db")
+    from api import app
+
+    endpoints = {}
+    try:
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(
+                app=app,
+                base_url="http://benchmark",
+                headers={"x-access-key": fixtures.ACCESS_KEY},
+                timeout=None,
+            ) as client:
+                for path, queries in ENDPOINTS.items():
+                    if args.endpoint and path not in args.endpoint:
+                        continue
+                    endpoints[path] = await bench_endpoint(
+                        client,
+                        path,
+                        queries,
+                        args.requests,
+                        args.concurrency,
+                        args.warmup,
+                    )
+                    result = endpoints[path]
+                    print(
+                        f"{path}: p50 {result['p50_ms']}ms p99 {result['p99_ms']}ms "
+                        f"{result['throughput_rps']} req/s",
+                        file=sys.stderr,
+                    )
+    finally:
+        server.shutdown()
+    return {"meta": metadata(args), "endpoints": endpoints}
+
+
+def metadata(args: argparse.Namespace) -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "warmup": args.warmup,
+        "seed": args.seed,
+    }
+
+
+def compare(before: dict, after: dict) -> str:
+    """a table of the change in each endpoint's percentiles and throughput"""
+    metrics = ("p50_ms", "p95_ms", "p99_ms", "throughput_rps")
+    lines = [f"{'endpoint':<32}" + "".join(f"{m:>24}" for m in metrics)]
+    for path, new in after["endpoints"].items():
+        if (old := before["endpoints"].get(path)) is None:
+            continue
+        cells = []
+        for m in metrics:
+            change = (new[m] - old[m]) / old[m] * 100 if old[m] else float("nan")
+            cells.append(f"{old[m]:>9.2f} -> {new[m]:<8.2f}{change:+5.0f}%")
+        lines.append(f"{path:<32}" + "".join(f"{cell:>24}" for cell in cells))
+    return "\n".join(lines)
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description=__doc__.strip()
+    )
+    parser.add_argument("--requests", type=int, default=200, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0, help="seed for the fixture data")
+    parser.add_argument(
+        "--endpoint", action="append", choices=list(ENDPOINTS), help="only these endpoints (repeatable)"
+    )
+    parser.add_argument("--output", type=Path, help="write the JSON here instead of stdout")
+    parser.add_argument(
+        "--compare", nargs=2, type=Path, metavar=("BEFORE", "AFTER"),
+        help="compare two result files instead of running",
+    )
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        before, after = (json.loads(path.read_text()) for path in args.compare)
+        print(compare(before, after))
+        return
+
+    with tempfile.TemporaryDirectory(prefix="data-api-bench-") as workdir:
+        result = asyncio.run(run(Path(workdir), args))
+    output = json.dumps(result, indent=2)
+    if args.output:
+        args.output.write_text(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Deterministic stand-ins for the upstream data and the app's database
+"""
+
+import datetime
+import hashlib
+import json
+import random
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from data.data.climate_prediction_center import ClimatePredictionCenter as CPC
+from data.data.reference import REGION_MAP
+
+ACCESS_KEY = "benchmark"
+FRED_SERIES = ("GANA", "UNRATE", "ACTLISCOUGA", "PENLISCOUGA")
+MISSING = -9999
+
+
+def _days(year: int, through: datetime.date | None = None) -> list[str]:
+    day, days = datetime.date(year, 1, 1), []
+    while day.year == year and (through is None or day <= through):
+        days.append(day.strftime(r"%Y%m%d"))
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def _write_cpc_file(
+    path: Path,
+    regions: list,
+    columns: list[str],
+    rng: random.Random,
+    missing_tail: int = 0,
+) -> None:
+    """a pipe-delimited file laid out like the CPC daily degree-day files"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    lines = [
+        " Daily Cooling Degree Days",
+        " Benchmark fixture",
+        " Population weighted",
+        "|".join(["Region", *columns]),
+    ]
+    for region in regions:
+        values = [str(rng.randint(0, 30)) for _ in columns]
+        # the latest file ends with days that have not been reported yet
+        values[len(values) - missing_tail :] = [str(MISSING)] * missing_tail
+        lines.append("|".join([str(region), *values]))
+    path.write_text("\n".join(lines) + "\n")
+
+
+def _fred_series(
+    rng: random.Random, months: int = 240, gaps: tuple[int] = ()
+) -> dict:
+    today = datetime.date.today().isoformat()
+    start = pd.Timestamp(datetime.date.today().replace(day=1)) - pd.DateOffset(
+        months=months
+    )
+    observations = [
+        {
+            "realtime_start": today,
+            "realtime_end": today,
+            "date": date.strftime(r"%Y-%m-%d"),
+            "value": "." if i in gaps else f"{rng.uniform(1_000, 50_000):.1f}",
+        }
+        for i, date in enumerate(pd.date_range(start, periods=months, freq="MS"))
+    ]
+    return {
+        "realtime_start": today,
+        "realtime_end": today,
+        "observation_start": "1600-01-01",
+        "observation_end": "9999-12-31",
+        "units": "lin",
+        "output_type": 1,
+        "file_type": "json",
+        "order_by": "observation_date",
+        "sort_order": "asc",
+        "count": months,
+        "offset": 0,
+        "limit": 100000,
+        "observations": observations,
+    }
+
+
+def write_upstream_fixtures(root: Path, seed: int = 0) -> None:
+    """
+    CPC files for the running year (as latest/ and by year), the two years
+    before it and the climatology, under `root`/cpc, and FRED series
+    under `root`/fred/<series id>.json
+    """
+    rng = random.Random(seed)
+    reference = pd.read_csv(REGION_MAP)
+    region_files = {
+        CPC.STATES_COOLING: sorted(reference["ST"].unique()),
+        CPC.CLIMATE_DIVS_COOLING: reference["Region ID"].to_list(),
+    }
+    yesterday = datetime.date.today() - datetime.timedelta(days=1)
+    cpc = root / "cpc"
+    for file_name, regions in region_files.items():
+        running_year = _days(yesterday.year, through=yesterday)
+        for period in (CPC.LATEST, f"{yesterday.year}/"):
+            _write_cpc_file(cpc / period / file_name, regions, running_year, rng, 2)
+        for year in (yesterday.year - 1, yesterday.year - 2):
+            _write_cpc_file(cpc / f"{year}/" / file_name, regions, _days(year), rng)
+        # climatology columns are MMDD over a leap year
+        normals = [day[4:] for day in _days(2000)]
+        _write_cpc_file(cpc / CPC.NORMALS / file_name, regions, normals, rng)
+
+    fred = root / "fred"
+    fred.mkdir(parents=True, exist_ok=True)
+    for series_id in FRED_SERIES:
+        gaps = (5,) if series_id == "GANA" else ()
+        series = _fred_series(rng, gaps=gaps)
+        (fred / f"{series_id}.json").write_text(json.dumps(series))
+
+
+def write_database(path: Path) -> None:
+    """a SQLite database with the access key and request log tables,
+    holding one valid key"""
+    path.unlink(missing_ok=True)
+    con = sqlite3.connect(path)
+    with con:
+        con.execute(
+            """
+            CREATE TABLE data_api_access_keys (
+                id INTEGER PRIMARY KEY,
+                keyhash TEXT NOT NULL,
+                expires TIMESTAMP,
+                revoked BOOLEAN NOT NULL DEFAULT 0,
+                last_used TIMESTAMP
+            )"""
+        )
+        con.execute(
+            """
+            CREATE TABLE data_api_request_log (
+                id INTEGER PRIMARY KEY,
+                agent TEXT,
+                path TEXT,
+                parameters TEXT,
+                ip TEXT,
+                time TIMESTAMP
+            )"""
+        )
+        con.execute(
+            "INSERT INTO data_api_access_keys (keyhash) VALUES (?)",
+            (hashlib.sha256(ACCESS_KEY.encode()).hexdigest(),),
+        )
+    con.close()
@@ -0,0 +1,53 @@
+"""
+Local HTTP server standing in for the CPC file server and the FRED API
+"""
+
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+
+class FixtureHandler(SimpleHTTPRequestHandler):
+    """
+    /cpc/... serves the fixture files as they are, with Last-Modified
+    and 304 responses to If-Modified-Since like the real file server.
+    /fred/series/observations serves fred/<series_id>.json, or FRED's
+    400 for a series it doesn't have
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == "/fred/series/observations":
+            return self._fred(parse_qs(url.query).get("series_id", [""])[0])
+        return super().do_GET()
+
+    def _fred(self, series_id: str) -> None:
+        path = Path(self.directory) / "fred" / f"{series_id}.json"
+        if series_id and path.is_file():
+            status, body = 200, path.read_bytes()
+        else:
+            status = 400
+            body = b'{"error_code":400,"error_message":"Bad Request."}'
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(root: Path) -> tuple[ThreadingHTTPServer, str]:
+    """Serve the fixtures under `root` on a free local port, from a daemon thread.
+    Returns the server and its base URL"""
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(FixtureHandler, directory=str(root))
+    )
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
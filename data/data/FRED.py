@@ -1,35 +1,82 @@
 """Interface for the FRED API"""
 
+import asyncio
 from os import getenv
 from dotenv import load_dotenv
-import requests
 import pandas as pd
 import numpy as np
 from logging import getLogger
 from pprint import pformat
 
-from data.data import df_to_list_objs_w_date_indx_as_attr, rolling_12, rolling_3
+from data.data import (
+    df_to_columns_w_date_indx,
+    df_to_list_objs_w_date_indx_as_attr,
+    gather_cancelling,
+    rolling_12,
+    rolling_3,
+    rolling_totals,
+)
+from data.data.cache import TTLCache
+from data.data.http_client import upstream
+from data.data.metrics import Collected, timed
+from data.data.single_flight import SingleFlight
 
 load_dotenv()
 
 logger = getLogger("uvicorn.info")
 
+# series refreshed in the background (see prefetch.py) and served from memory
+# between refreshes; everything else is fetched from FRED on each request.
+# Copies are kept per api key: one is only served to the key FRED returned it
+# to, so FRED still decides which keys get data
+FRED_HOT_SERIES = tuple(
+    series_id.strip()
+    for series_id in getenv("FRED_HOT_SERIES", "").split(",")
+    if series_id.strip()
+)
+FRED_HOT_TTL = float(getenv("FRED_HOT_TTL", 2 * 60 * 60))
+FRED_HOT_KEYS = int(getenv("FRED_HOT_KEYS", 16))
+
+# (api key, series id) -> FRED response
+fred_hot = TTLCache(maxsize=max(len(FRED_HOT_SERIES), 1) * FRED_HOT_KEYS)
+fred_fetches = SingleFlight("fred")
+Collected(
+    "data_api_fred_hot_lookups_total",
+    "FRED_HOT_SERIES lookups; a stale or missing entry counts as a miss",
+    collect=lambda: {("hit",): fred_hot.hits, ("miss",): fred_hot.misses},
+    labels=("result",),
+    kind="counter",
+)
+
+FRED_BATCH_CONCURRENCY = int(getenv("FRED_BATCH_CONCURRENCY", 8))
+
 
 class FRED:
 
     NAN_CHAR = "."
+    ROOT_URL = getenv("FRED_ROOT_URL", "https://api.stlouisfed.org/fred")
 
-    def __init__(self, api_key: str | None = None):
+    def __init__(self, api_key: str | None = None, columnar: bool = False):
         if not api_key:
             api_key = getenv(
                 "FRED_API_KEY"
             )  # temporary until testing of API with front end dev is complete
-        ROOT_URL = "https://api.stlouisfed.org/fred"
         SERIES_URL = (
-            ROOT_URL + "/series/observations?series_id={series_id}&file_type=json"
+            self.ROOT_URL + "/series/observations?series_id={series_id}&file_type=json"
         )
+        self.api_key = api_key
         API_PARAMETER = f"&api_key={api_key}"
         self.FULL_URL = SERIES_URL + API_PARAMETER
+        # observations as one array per field, numbers with null for gaps,
+        # instead of an object of strings per date
+        self.columnar = columnar
+
+    def observations(self, data: pd.DataFrame) -> dict:
+        if self.columnar:
+            return df_to_columns_w_date_indx(data, "observations")
+        return df_to_list_objs_w_date_indx_as_attr(
+            data, "observations", na_rep=self.NAN_CHAR
+        )
 
     def sep_meta_from_obs_and_prep_obs_for_pandas(
         self, data: dict
@@ -37,44 +84,151 @@ class FRED:
         metadata = {k: v for k, v in data.items() if k != "observations"}
         observations: list[dict] = data["observations"]
 
+        # copied, as responses are shared between requests (FRED_HOT_SERIES, single flight)
         def convert_values(observation: dict) -> dict:
+            observation = {k: v for k, v in observation.items() if k != "date"}
             value = observation.get("value")
             observation["value"] = float(value) if value != self.NAN_CHAR else np.nan
             return observation
 
-        observations = list(map(convert_values, observations))
         df_data = {
-            pd.to_datetime(observation.pop("date"), format=r"%Y-%m-%d"): observation
+            pd.to_datetime(observation["date"], format=r"%Y-%m-%d"): convert_values(observation)
             for observation in observations
         }
         return metadata, df_data
 
     async def get_data(self, series_id: str) -> dict:
-        response = requests.get(self.FULL_URL.format(series_id=series_id))
-        data: dict = response.json()
+        if series_id not in FRED_HOT_SERIES:
+            return await self.download(series_id)
+        entry = fred_hot.get((self.api_key, series_id))
+        if entry and entry.fresh():
+            return entry.value
+        return await self.refresh(series_id)
+
+    async def refresh(self, series_id: str) -> dict:
+        """Fetch `series_id` into `fred_hot` for this api key. If FRED returns an
+        error instead (e.g. the key was revoked), the key's copy is dropped"""
+        data = await self.download(series_id)
+        if "observations" in data:
+            fred_hot.set((self.api_key, series_id), data, FRED_HOT_TTL)
+        else:
+            fred_hot.discard((self.api_key, series_id))
+        return data
+
+    async def download(self, series_id: str) -> dict:
+        url = self.FULL_URL.format(series_id=series_id)
+        # concurrent requests for the same series (and api key) share one download
+        return await fred_fetches.do(url, lambda: self._download(url))
+
+    async def _download(self, url: str) -> dict:
+        with timed("fred_download"):
+            response = await upstream.get(url)
+        with timed("fred_decode"):
+            data: dict = response.json()
         return data
 
     async def data_enriched(self, data: pd.DataFrame) -> dict:
-        data = data.merge(
-            rolling_12(data["value"].interpolate()), left_index=True, right_index=True
-        )
-        data = data.merge(
-            rolling_3(data["value"].interpolate()), left_index=True, right_index=True
-        )
-        data = data.fillna(self.NAN_CHAR)
-        return data.astype(str)
+        with timed("fred_enrich"):
+            data = data.merge(
+                rolling_12(data["value"].interpolate()), left_index=True, right_index=True
+            )
+            data = data.merge(
+                rolling_3(data["value"].interpolate()), left_index=True, right_index=True
+            )
+        # values are rendered as strings, with NAN_CHAR for gaps, when serialized
+        return data
 
     async def fred_series(self, series_id: str) -> dict:
-        data = await self.get_data(series_id)
-        metadata, df_data = self.sep_meta_from_obs_and_prep_obs_for_pandas(data)
-        observations_df = pd.DataFrame.from_dict(df_data, orient="index")
+        return await self.series_from_data(await self.get_data(series_id))
+
+    async def series_from_data(self, data: dict) -> dict:
+        """`fred_series` output from a FRED observations response"""
+        with timed("fred_frame"):
+            metadata, df_data = self.sep_meta_from_obs_and_prep_obs_for_pandas(data)
+            observations_df = pd.DataFrame.from_dict(df_data, orient="index")
         observations_df = await self.data_enriched(observations_df)
         # recombine metadata and observervations as a list of dicts, moving the date index into a key-value pair in the observation
-        result = metadata | df_to_list_objs_w_date_indx_as_attr(
-            observations_df, "observations"
-        )
+        with timed("fred_serialize"):
+            result = metadata | self.observations(observations_df)
         return result
 
+    async def fred_series_batch(
+        self, series_ids: list[str], concurrency: int = FRED_BATCH_CONCURRENCY
+    ) -> dict:
+        """
+        `fred_series` for each of `series_ids`, with at most `concurrency` fetches
+        from FRED in flight. Series that share the same observation dates are
+        enriched together, as the columns of one frame.
+
+        Returns {"series": {series_id: fred_series output}, "errors": {series_id: message}},
+        so a series that fails doesn't fail the others
+        """
+        responses = await self.get_data_batch(series_ids, concurrency)
+        return await self.series_batch_from_data(responses)
+
+    async def get_data_batch(
+        self, series_ids: list[str], concurrency: int = FRED_BATCH_CONCURRENCY
+    ) -> dict[str, dict | Exception]:
+        """series_id -> FRED response, or the exception fetching it raised"""
+        series_ids = list(dict.fromkeys(series_ids))
+        fetch_limit = asyncio.Semaphore(concurrency)
+
+        async def fetch(series_id: str) -> dict:
+            async with fetch_limit:
+                return await self.get_data(series_id)
+
+        responses = await asyncio.gather(
+            *map(fetch, series_ids), return_exceptions=True
+        )
+        return dict(zip(series_ids, responses))
+
+    async def series_batch_from_data(self, responses: dict[str, dict | Exception]) -> dict:
+        """`fred_series_batch` output from `get_data_batch`'s responses"""
+        metadata, frames, errors = {}, {}, {}
+        for series_id, data in responses.items():
+            if isinstance(data, Exception):
+                errors[series_id] = str(data) or type(data).__name__
+            elif not data.get("observations"):
+                # an empty list too: its frame would have no value column to enrich
+                errors[series_id] = data.get("error_message", "no observations returned")
+            else:
+                try:
+                    with timed("fred_frame"):
+                        meta, df_data = self.sep_meta_from_obs_and_prep_obs_for_pandas(data)
+                        frame = pd.DataFrame.from_dict(df_data, orient="index")
+                except (KeyError, TypeError, ValueError) as e:
+                    errors[series_id] = f"unreadable observations: {e}"
+                else:
+                    metadata[series_id], frames[series_id] = meta, frame
+
+        # one wide frame per set of observation dates, so rolling windows
+        # still cover the same observations as they would series by series
+        by_dates: dict[bytes, list[str]] = {}
+        for series_id, frame in frames.items():
+            dates = frame.index.to_numpy(dtype="datetime64[ns]").tobytes()
+            by_dates.setdefault(dates, []).append(series_id)
+        for group in by_dates.values():
+            values = pd.DataFrame({series_id: frames[series_id]["value"] for series_id in group})
+            with timed("fred_enrich"):
+                values = values.interpolate()
+                rolling_12_total, rolling_12_pct = rolling_totals(values, 12)
+                rolling_3_total, rolling_3_pct = rolling_totals(values, 3)
+            for series_id in group:
+                frame = frames[series_id]
+                frame["rolling_12_month_total"] = rolling_12_total[series_id]
+                frame["rolling_12_12_pct"] = rolling_12_pct[series_id]
+                frame["rolling_3_month_total"] = rolling_3_total[series_id]
+                frame["rolling_3_12_pct"] = rolling_3_pct[series_id]
+
+        series = {}
+        with timed("fred_serialize"):
+            for series_id in responses:
+                if series_id in frames:
+                    series[series_id] = metadata[series_id] | self.observations(
+                        frames[series_id]
+                    )
+        return {"series": series, "errors": errors}
+
     async def housing_inventory_by_state(self, state: str) -> dict:
         """The National Association of Realtors defines Housing Inventory as
         'Inventory is calculated monthly by taking a count of the number of
@@ -82,12 +236,24 @@ class FRED:
 
         Source: https://www.nar.realtor/blogs/economists-outlook/inventory-and-months-supply#:~:text=When%20a%20seller%20lists%20a,last%20day%20of%20the%20month.
         """
+        return await self.housing_inventory_from_data(
+            *await self.get_housing_inventory_data(state)
+        )
+
+    async def get_housing_inventory_data(self, state: str) -> tuple[dict, dict]:
+        """FRED responses for the state's active listings and pending listings series"""
         base_series_id_active = "ACTLISCOU"
         base_series_id_pending = "PENLISCOU"
 
-        active_listings = await self.get_data(base_series_id_active + state)
-        pending_listings = await self.get_data(base_series_id_pending + state)
+        return await gather_cancelling(
+            self.get_data(base_series_id_active + state),
+            self.get_data(base_series_id_pending + state),
+        )
 
+    async def housing_inventory_from_data(
+        self, active_listings: dict, pending_listings: dict
+    ) -> dict:
+        """`housing_inventory_by_state` output from `get_housing_inventory_data`'s responses"""
         meta_active, obs_active = self.sep_meta_from_obs_and_prep_obs_for_pandas(
             active_listings
         )
@@ -118,7 +284,6 @@ class FRED:
         inventory = inventory.drop(columns=["value_a", "value_p"])
         inventory = await self.data_enriched(inventory)
         # recombine metadata and observervations as a list of dicts, moving the date index into a key-value pair in the observation
-        result = meta_active | df_to_list_objs_w_date_indx_as_attr(
-            inventory, "observations"
-        )
+        with timed("fred_serialize"):
+            result = meta_active | self.observations(inventory)
         return result
@@ -1,33 +1,125 @@
+import asyncio
+from operator import itemgetter
+from typing import Literal
+
+import numpy as np
 import pandas as pd
-import datetime
 
-def df_to_list_objs_w_date_indx_as_attr(df: pd.DataFrame, top_lvl_key: str) -> dict[str,list]:
+# "records": an object per date (df_to_list_objs_w_date_indx_as_attr)
+# "columnar": one array per column (df_to_columns_w_date_indx)
+ResponseFormat = Literal["records", "columnar"]
+
+def _column_as_str(values: np.ndarray, na_rep: str) -> list[str]:
+    strings = list(map(str, values.tolist()))
+    for i in np.flatnonzero(pd.isna(values)):
+        strings[i] = na_rep
+    return strings
+
+
+def _rows(df: pd.DataFrame, na_rep: str | None = None) -> list:
+    """
+    row-wise python values of the dataframe, read from the underlying arrays
+    each column keeps its own dtype (ints stay ints next to float columns), and with
+    `na_rep` set every value is rendered as a string with nulls replaced by `na_rep`
+    """
+    if na_rep is None and df.dtypes.nunique() <= 1:
+        return df.to_numpy().tolist()
+    columns = []
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].to_numpy()
+        if na_rep is None:
+            columns.append(values.tolist())
+        else:
+            columns.append(_column_as_str(values, na_rep))
+    return list(zip(*columns))
+
+
+def df_to_list_objs_w_date_indx_as_attr(
+    df: pd.DataFrame, top_lvl_key: str, na_rep: str | None = None
+) -> dict[str, list]:
     """
     the dataframe provided is broken out into a list of objects, in which the index is moved into each object
     returns the list as a value to a dictionary, under the key provided in the arg `top_lvl_key`
+
+    a two-level column index (state, sub-division) is nested as {state: {sub-division: value}}
+    `na_rep` renders all values as strings, with nulls as `na_rep`
     """
-    df_dict = df.to_dict(orient="index")
-    df_dict_exploded_multi_index: dict[datetime.datetime, dict] = {}
-    match list(df_dict.get(list(df_dict)[0]))[0]:
-        case (k1, k2):
-            delevel_keys = True
-        case _:
-            delevel_keys = False
-
-    if delevel_keys:
-        for date, row in df_dict.items():
-            row: dict
-            df_dict_exploded_multi_index[date] = {}
-            for multi_key, value in row.items():
-                state, subd_code = multi_key
-                if not df_dict_exploded_multi_index[date].get(state):
-                    df_dict_exploded_multi_index[date][state] = {subd_code: value}
-                else:
-                    df_dict_exploded_multi_index[date][state].update({subd_code: value})
-
-        df_dict = df_dict_exploded_multi_index
-
-    return {top_lvl_key: [{"date": str(i.date())} | v for i, v in df_dict.items()]}
+    dates = np.datetime_as_string(
+        df.index.to_numpy(dtype="datetime64[ns]"), unit="D"
+    ).tolist()
+    rows = _rows(df, na_rep)
+
+    if isinstance(df.columns, pd.MultiIndex):
+        groups: dict[str, tuple[list, list[int]]] = {}
+        for position, (state, subd_code) in enumerate(df.columns):
+            keys, positions = groups.setdefault(state, ([], []))
+            keys.append(subd_code)
+            positions.append(position)
+        getters = [
+            (
+                state,
+                keys,
+                (
+                    itemgetter(*positions)
+                    if len(positions) > 1
+                    else lambda row, p=positions[0]: (row[p],)
+                ),
+            )
+            for state, (keys, positions) in groups.items()
+        ]
+        observations = [
+            {"date": date}
+            | {state: dict(zip(keys, get(row))) for state, keys, get in getters}
+            for date, row in zip(dates, rows)
+        ]
+    else:
+        columns = df.columns.tolist()
+        observations = [
+            {"date": date} | dict(zip(columns, row)) for date, row in zip(dates, rows)
+        ]
+
+    return {top_lvl_key: observations}
+
+
+def _columns(df: pd.DataFrame) -> list:
+    """
+    each column of the dataframe, numeric ones as contiguous numpy arrays for orjson to
+    serialize directly (OPT_SERIALIZE_NUMPY, NaN as null), anything else as a list
+    """
+    if df.dtypes.nunique() == 1 and df.dtypes.iloc[0].kind in "biuf":
+        # one copy of the whole block, transposed so that each column is contiguous
+        return list(np.ascontiguousarray(df.to_numpy().T))
+    columns = []
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].to_numpy()
+        if values.dtype.kind in "biuf":
+            columns.append(np.ascontiguousarray(values))
+        else:
+            columns.append(values.tolist())
+    return columns
+
+
+def df_to_columns_w_date_indx(df: pd.DataFrame, top_lvl_key: str) -> dict[str, dict]:
+    """
+    the dataframe provided as a list of dates (the index) and an array of values per column
+    returns {top_lvl_key: {"dates": [...], "values": {column: [...]}}}
+
+    a two-level column index (state, sub-division) is nested as {state: {sub-division: values}}
+    """
+    dates = np.datetime_as_string(
+        df.index.to_numpy(dtype="datetime64[ns]"), unit="D"
+    ).tolist()
+    columns = _columns(df)
+
+    if isinstance(df.columns, pd.MultiIndex):
+        values: dict[str, dict] = {}
+        for (state, subd_code), column in zip(df.columns, columns):
+            values.setdefault(state, {})[subd_code] = column
+    else:
+        values = dict(zip(df.columns.tolist(), columns))
+
+    return {top_lvl_key: {"dates": dates, "values": values}}
+
 
 def rolling_12(data: pd.Series) -> pd.DataFrame:
     rolling_12 = data.rolling(12).sum()
@@ -44,5 +136,25 @@ def rolling_3(data: pd.Series) -> pd.DataFrame:
     rolling_3_pct.name = "rolling_3_12_pct"
     return pd.merge(rolling_3,rolling_3_pct, left_index=True, right_index=True)
 
+def rolling_totals(data: pd.DataFrame, window: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """rolling_12/rolling_3 for every column of `data` at once: the rolling
+    `window`-period totals, and their change on the totals 12 periods earlier"""
+    totals = data.rolling(window).sum()
+    return totals, (totals / totals.shift(12)) - 1
+
 def cumulative_differences(df1: pd.DataFrame, df2: pd.DataFrame) -> pd.DataFrame:
-    return (df1 - df2).cumsum().dropna()
\ No newline at end of file
+    return (df1 - df2).cumsum().dropna()
+
+async def gather_cancelling(*aws) -> list:
+    """
+    like asyncio.gather, but as soon as one awaitable fails the others are cancelled
+    and the first exception is raised as-is
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
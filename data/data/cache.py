@@ -0,0 +1,102 @@
+"""
+    In-process cache for parsed upstream data.
+    Entries expire after a TTL and keep the HTTP validators they were fetched
+    with, so a stale entry can be revalidated with a conditional request
+    instead of being downloaded again.
+    Each stored value gets a new version number (kept when an entry is
+    renewed), for anything derived from it to check whether it is outdated.
+"""
+
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass
+from time import monotonic
+from typing import Any, Callable, Hashable
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    expires: float
+    etag: str | None = None
+    last_modified: str | None = None
+    version: int = 0
+
+    def fresh(self) -> bool:
+        return monotonic() < self.expires
+
+    def renew(self, ttl: float) -> None:
+        self.expires = monotonic() + ttl
+
+
+_versions = itertools.count(1)
+
+
+class TTLCache:
+    """
+    LRU mapping of key -> CacheEntry, bounded to `maxsize` entries and, with
+    `max_bytes`, to that many bytes of values as measured by `sizeof`.
+    A value bigger than `max_bytes` on its own isn't stored
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        max_bytes: int | None = None,
+        sizeof: Callable[[Any], int] = len,
+    ) -> None:
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.entries: OrderedDict[Hashable, CacheEntry] = OrderedDict()
+        self.sizes: dict[Hashable, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> CacheEntry | None:
+        """Returns the entry, fresh or stale, and marks it most recently used"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        if entry.fresh():
+            self.hits += 1
+        else:
+            self.misses += 1
+        return entry
+
+    def set(
+        self,
+        key: Hashable,
+        value: Any,
+        ttl: float,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> CacheEntry:
+        entry = CacheEntry(
+            value, monotonic() + ttl, etag, last_modified, next(_versions)
+        )
+        self.discard(key)
+        if self.max_bytes is not None:
+            size = self.sizeof(value)
+            if size > self.max_bytes:
+                return entry
+            self.sizes[key] = size
+            self.bytes += size
+        self.entries[key] = entry
+        while len(self.entries) > self.maxsize or (
+            self.max_bytes is not None and self.bytes > self.max_bytes
+        ):
+            self.discard(next(iter(self.entries)))
+        return entry
+
+    def discard(self, key: Hashable) -> None:
+        if self.entries.pop(key, None) is not None:
+            self.bytes -= self.sizes.pop(key, 0)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.sizes.clear()
+        self.bytes = 0
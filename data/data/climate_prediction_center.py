@@ -3,15 +3,163 @@
     Degree Day raw data is updated daily and available in pipe-delimited format
 """
 
-import pandas as pd
-import datetime
+import asyncio
 import calendar
+import datetime
+import re
+from functools import partial
+from io import BytesIO
+from os import getenv
+from logging import getLogger
+from typing import Callable, Hashable
+
+import numpy as np
+import pandas as pd
 
-from data.data import df_to_list_objs_w_date_indx_as_attr, cumulative_differences
+from data.data import (
+    df_to_columns_w_date_indx,
+    df_to_list_objs_w_date_indx_as_attr,
+    cumulative_differences,
+    gather_cancelling,
+)
+from data.data.cache import CacheEntry, TTLCache
+from data.data.cumulative import cumulative_views, daily_differences
+from data.data.http_client import upstream
+from data.data.metrics import Collected, timed
+from data.data.single_flight import SingleFlight
+from data.data.snapshots import snapshots
+from data.data.reference import get_reference_data
+
+logger = getLogger("uvicorn.info")
+
+# files for the running year gain a day of data daily, so they are revalidated
+# hourly, while completed years and the climatology are fixed once published
+CPC_CACHE_SIZE = int(getenv("CPC_CACHE_SIZE", 16))
+CPC_LIVE_TTL = float(getenv("CPC_LIVE_TTL", 60 * 60))
+CPC_ARCHIVE_TTL = float(getenv("CPC_ARCHIVE_TTL", 7 * 24 * 60 * 60))
+
+cpc_files = TTLCache(maxsize=CPC_CACHE_SIZE)
+cpc_fetches = SingleFlight("cpc")
+Collected(
+    "data_api_cpc_cache_lookups_total",
+    "CPC file cache lookups; a stale entry counts as a miss",
+    collect=lambda: {("hit",): cpc_files.hits, ("miss",): cpc_files.misses},
+    labels=("result",),
+    kind="counter",
+)
+Collected(
+    "data_api_cpc_running_totals_total",
+    "Running totals extended by appended days or recomputed in full",
+    collect=lambda: {
+        ("extended",): cumulative_views.extended,
+        ("recomputed",): cumulative_views.recomputed,
+    },
+    labels=("update",),
+    kind="counter",
+)
+
+
+def is_live(url: str) -> bool:
+    """whether the file at `url` can still change (latest/ or the running year)"""
+    if ClimatePredictionCenter.LATEST in url:
+        return True
+    year = re.search(r"/(\d{4})/[^/]+$", url)
+    # the prior year's directory can still be filling in early January
+    live_year = (datetime.datetime.now() - datetime.timedelta(days=31)).year
+    return bool(year) and int(year.group(1)) >= live_year
+
+
+def cpc_file_ttl(url: str) -> float:
+    return CPC_LIVE_TTL if is_live(url) else CPC_ARCHIVE_TTL
+
+
+def _parse_cpc_file(content: bytes) -> pd.DataFrame:
+    data = pd.read_csv(BytesIO(content), skiprows=3, delimiter="|")
+    return data.set_index("Region")
+
+
+async def read_cpc_file(url: str) -> pd.DataFrame:
+    """
+    Returns the pipe-delimited CPC file at `url` as a DataFrame indexed by Region.
+    The cached frame is shared, so callers get a shallow copy and must not
+    modify its values in place.
+    """
+    entry = await fetch_cpc_file(url)
+    return entry.value.copy(deep=False)
+
+
+async def fetch_cpc_file(url: str, refresh: bool = False) -> CacheEntry:
+    """
+    The `cpc_files` entry for the CPC file at `url`, served from the cache
+    while fresh and revalidated with the server's ETag/Last-Modified once stale,
+    or right away with `refresh`.
+    The entry's value is shared and must not be modified.
+    """
+    entry = cpc_files.get(url)
+    if entry and entry.fresh() and not refresh:
+        return entry
+    # concurrent requests for the file share one download and parse
+    return await cpc_fetches.do(url, lambda: _update_cpc_file(url, entry))
+
+
+async def _update_cpc_file(url: str, entry: CacheEntry | None) -> CacheEntry:
+    live = is_live(url)
+    if not live:
+        with timed("cpc_snapshot_load"):
+            data = snapshots.load(url)
+        if data is not None:
+            entry = cpc_files.set(url, data, CPC_ARCHIVE_TTL)
+            return entry
+    headers = {}
+    if entry and entry.etag:
+        headers["If-None-Match"] = entry.etag
+    if entry and entry.last_modified:
+        headers["If-Modified-Since"] = entry.last_modified
+    with timed("cpc_download"):
+        response = await upstream.get(url, headers=headers)
+    if response.status_code == 304 and entry:
+        entry.renew(cpc_file_ttl(url))
+        return entry
+    response.raise_for_status()
+    # parsing a full climate-division file takes long enough to stall the loop
+    with timed("cpc_parse"):
+        data = await asyncio.to_thread(_parse_cpc_file, response.content)
+    entry = cpc_files.set(
+        url,
+        data,
+        cpc_file_ttl(url),
+        etag=response.headers.get("ETag"),
+        last_modified=response.headers.get("Last-Modified"),
+    )
+    if not live:
+        try:
+            await asyncio.to_thread(snapshots.save, url, data)
+        except OSError as e:
+            logger.warning(f"could not save a snapshot of {url}: {e}")
+    return entry
+
+
+async def backfill_snapshots(years: list[int]) -> None:
+    """Fetch and snapshot the cooling degree-day files for completed `years`
+    and the climatology, skipping any that are already stored"""
+    cpc = ClimatePredictionCenter
+    periods = [f"{year}/" for year in years] + [cpc.NORMALS]
+    for period in periods:
+        for file_name in (cpc.STATES_COOLING, cpc.CLIMATE_DIVS_COOLING):
+            url = cpc.BASE_URL + period + file_name
+            if is_live(url) or url in snapshots:
+                continue
+            try:
+                await read_cpc_file(url)
+            except Exception as e:
+                logger.warning(f"snapshot backfill failed for {url}: {e}")
 
 
 class ClimatePredictionCenter:
-    BASE_URL = "https://ftp.cpc.ncep.noaa.gov/htdocs/degree_days/weighted/daily_data/"
+    BASE_URL = getenv(
+        "CPC_BASE_URL",
+        "https://ftp.cpc.ncep.noaa.gov/htdocs/degree_days/weighted/daily_data/",
+    )
     LATEST = "latest/"
     NORMALS = "climatology/1981-2010/"
     STATES_COOLING = "StatesCONUS.Cooling.txt"
@@ -26,12 +174,22 @@ class ClimatePredictionCenter:
             states_selected: list,
             base_year: int=None,
             climate_divisions: bool=False,
-            customer_id: int=None) -> None:
+            customer_id: int=None,
+            start: datetime.date=None,
+            end: datetime.date=None,
+            last_n_days: int=None,
+            columnar: bool=False) -> None:
         
         self.states_selected = states_selected
         self.base_year = base_year
         self.customer = customer_id
         self.climate_divs = climate_divisions if not customer_id else True
+        # the dates returned; totals are still accumulated from January 1
+        self.start = pd.Timestamp(start) if start else None
+        self.end = pd.Timestamp(end) if end else None
+        self.last_n_days = last_n_days
+        # observations as one array per region instead of an object per date
+        self.columnar = columnar
         self.current_year = datetime.datetime.now().year
         self.length = 0
         self._raw = True
@@ -43,12 +201,10 @@ class ClimatePredictionCenter:
         else:
             self.prior_year = self.current_year - 1
 
-    async def get_customer_climate_codes(self) -> list:
-        customers = pd.read_csv("./data/ga_customers.csv").set_index("ID")
-        customer_name = customers.loc[self.customer].at["Customer"]
-        self.customer_name = customer_name
-        branches = pd.read_csv("./data/ga_branches.csv", dtype={"Climate Division": int})
-        return list(set(branches.loc[branches["company_id"] == self.customer, "Climate Division"].to_list()))
+    async def get_customer_climate_codes(self) -> np.ndarray:
+        reference = get_reference_data()
+        self.customer_name = reference.customer_names[self.customer]
+        return reference.customer_divisions[self.customer]
 
     def metadata(self) -> dict:
         if self.base_year:
@@ -106,79 +262,181 @@ class ClimatePredictionCenter:
 
 
     async def get_current_daily(self) -> pd.DataFrame:
-        data = pd.read_csv(self.full_url_base_daily(), skiprows=3, delimiter="|")
-        data = data.set_index('Region')
-        first_observation_year = int(data.columns.to_list()[0][:4])
+        _, data = await self._current_daily()
+        return self._selected(data)
+
+
+    async def get_prior_year_daily(self) -> pd.DataFrame:
+        _, data = await self._prior_year_daily()
+        return self._selected(data)
+
+
+    async def get_normals_daily(self) -> pd.DataFrame:
+        _, data = await self._normals_daily()
+        return self._selected(data)
+
+
+    async def source_files(self, differences: bool=False, normals: bool=False) -> dict[str, CacheEntry]:
+        """
+        url -> cache entry of the CPC files a response would be built from,
+        to version it before any of the work is done
+        """
+        if normals:
+            url = self.full_url_base_normals()
+            return {url: await fetch_cpc_file(url)}
+        url = self.full_url_base_daily()
+        files = {url: await fetch_cpc_file(url)}
+        if differences:
+            first_observation_year = int(files[url].value.columns[0][:4])
+            if first_observation_year == self.prior_year:
+                # the same edge case as in _current_daily, which settles the comparison year
+                self.prior_year -= 1
+            comparison_url = self.full_url_comparison_year()
+            files[comparison_url] = await fetch_cpc_file(comparison_url)
+        return files
+
+
+    async def _current_daily(self, cumulative: bool=False) -> tuple[Hashable, pd.DataFrame]:
+        url = self.full_url_base_daily()
+        entry = await fetch_cpc_file(url)
+        first_observation_year = int(entry.value.columns[0][:4])
 
         if first_observation_year == self.prior_year:
             # edge case for latest data pulling the year prior at the beginning of the new year
             self.prior_year -= 1
 
-        data.columns = [pd.to_datetime(date, format=r"%Y%m%d") for date in data.columns]
+        return await self._daily(("current", url), entry, self._reshape_current, cumulative)
+
+
+    async def _prior_year_daily(self) -> tuple[Hashable, pd.DataFrame]:
+        url = self.full_url_comparison_year()
+        entry = await fetch_cpc_file(url)
+        return await self._daily(("prior", url), entry, self._reshape_prior_year)
+
+
+    async def _normals_daily(self, cumulative: bool=False) -> tuple[Hashable, pd.DataFrame]:
+        url = self.full_url_base_normals()
+        entry = await fetch_cpc_file(url)
+        ref_year = self.base_year if self.base_year else self.current_year
+        reshape = partial(self._reshape_normals, ref_year=ref_year)
+        self._normals = True
+        return await self._daily(("normals", url, ref_year), entry, reshape, cumulative)
+
+
+    async def _daily(
+            self,
+            key: Hashable,
+            entry: CacheEntry,
+            reshape: Callable[[pd.DataFrame], pd.DataFrame],
+            cumulative: bool=False
+        ) -> tuple[Hashable, pd.DataFrame]:
+        """
+        The file in `entry` reshaped to dates x regions, or its running totals,
+        and the version of the file it came from.
+        Frames for every region are kept in `cumulative_views`; a customer's
+        climate divisions are reshaped from the file on each request.
+        """
+        if self.customer:
+            climate_divisions = await self.get_customer_climate_codes()
+            data = reshape(entry.value.loc[climate_divisions])
+            if cumulative:
+                with timed("cpc_cumulative"):
+                    data = data.cumsum()
+            return None, data
+        daily = cumulative_views.daily(
+            key, entry.version, lambda: reshape(entry.value.copy(deep=False))
+        )
+        if not cumulative:
+            return entry.version, daily
+        # the daily frame is held now, so this only times the running totals
+        with timed("cpc_cumulative"):
+            totals = cumulative_views.totals(key, entry.version, lambda: daily)
+        return entry.version, totals
+
+
+    def _windowed(self, data: pd.DataFrame) -> pd.DataFrame:
+        """the rows of `data` in the requested date window"""
+        if self.last_n_days:
+            if data.empty:
+                return data
+            return data.loc[data.index[-1] - pd.Timedelta(days=self.last_n_days - 1):]
+        if self.start or self.end:
+            return data.loc[self.start:self.end]
+        return data
+
+
+    def _selected(self, data: pd.DataFrame) -> pd.DataFrame:
+        # a customer's frame only holds their climate divisions already
+        if self.customer:
+            return data
+        return data.loc[:,(self.states_selected)]
+
+
+    def _reshape_current(self, data: pd.DataFrame) -> pd.DataFrame:
+        with timed("cpc_dates"):
+            data.columns = [pd.to_datetime(date, format=r"%Y%m%d") for date in data.columns]
         if self.climate_divs:
-            if self.customer:
-                climate_divisions = await self.get_customer_climate_codes()
-                data = data.loc[climate_divisions]
-            data = await self.match_climate_ids_to_states(data)
-        data = data.T
-        # Source Data may have nonsense negative values like -9999
-        # for every state. Filter those out.
-        data = data[data.ge(0).all(1)] 
-        if not self.customer:
-            data = data.loc[:,(self.states_selected)]
+            data = self._label_regions(data)
+        with timed("cpc_reshape"):
+            data = data.T
+            # Source Data may have nonsense negative values like -9999
+            # for every state. Filter those out.
+            data = data[data.ge(0).all(1)] 
         return data
 
 
-    async def get_prior_year_daily(self) -> pd.DataFrame:
-        data = pd.read_csv(self.full_url_comparison_year(), skiprows=3, delimiter="|")
-        data = data.set_index('Region')
-        first_observation_year = int(data.columns.to_list()[0][:4])
+    def _reshape_prior_year(self, data: pd.DataFrame) -> pd.DataFrame:
+        first_observation_year = int(data.columns[0][:4])
 
         if calendar.isleap(first_observation_year):
             data = data.loc[:,~data.columns.str.endswith('0229')]
 
-        data.columns = [pd.to_datetime(date, format=r"%Y%m%d") for date in data.columns]
+        with timed("cpc_dates"):
+            data.columns = [pd.to_datetime(date, format=r"%Y%m%d") for date in data.columns]
         if self.climate_divs:
-            if self.customer:
-                climate_divisions = await self.get_customer_climate_codes()
-                data = data.loc[climate_divisions]
-            data = await self.match_climate_ids_to_states(data)
-        data = data.T
-        if not self.customer:
-            data = data.loc[:,(self.states_selected)]
-        data = data.reset_index()
-        data["ref_date_index"] = data["index"] + pd.DateOffset(years=1)
-        data = data.set_index("ref_date_index").drop(columns="index", level=0 if self.climate_divs else None)
+            data = self._label_regions(data)
+        with timed("cpc_reshape"):
+            data = data.T
+            data = data.reset_index()
+            data["ref_date_index"] = data["index"] + pd.DateOffset(years=1)
+            data = data.set_index("ref_date_index").drop(columns="index", level=0 if self.climate_divs else None)
         return data
 
 
-    async def get_normals_daily(self) -> pd.DataFrame:
-        data = pd.read_csv(self.full_url_base_normals(), skiprows=3, delimiter="|")
-        data = data.set_index('Region')
-        ref_year = self.base_year if self.base_year else self.current_year
-
+    def _reshape_normals(self, data: pd.DataFrame, ref_year: int) -> pd.DataFrame:
         if not calendar.isleap(ref_year):
             data = data.loc[:,~data.columns.str.endswith('0229')]
 
-        data.columns = [pd.to_datetime(str(ref_year) + date, format=r"%Y%m%d") for date in data.columns]
+        with timed("cpc_dates"):
+            data.columns = [pd.to_datetime(str(ref_year) + date, format=r"%Y%m%d") for date in data.columns]
         if self.climate_divs:
-            if self.customer:
-                climate_divisions = await self.get_customer_climate_codes()
-                data = data.loc[climate_divisions]
-            data = await self.match_climate_ids_to_states(data)
-        data = data.T
-        if not self.customer:
-            data = data.loc[:,(self.states_selected)]
-        self._normals = True
+            data = self._label_regions(data)
+        with timed("cpc_reshape"):
+            data = data.T
         return data
 
 
     async def cooling_degree_days_diff_yoy(self) -> dict:
-        current_year_obs = await self.get_current_daily()
-        prior_year_obs = await self.get_prior_year_daily()
-        cum_diffs_df = cumulative_differences(current_year_obs, prior_year_obs)
-        if not self.climate_divs:   # BUG: Totals, if I keep them, should apply by date, summing the average of the climate divisions
-            cum_diffs_df["total"] = cum_diffs_df.apply(sum, axis=1)
+        prior_year = self.prior_year
+        (current_version, current_year_obs), (prior_version, prior_year_obs) = await gather_cancelling(
+            self._current_daily(), self._prior_year_daily()
+        )
+        if self.prior_year != prior_year:
+            # latest/ still held last year's data, which moved the comparison year back
+            prior_version, prior_year_obs = await self._prior_year_daily()
+        with timed("cpc_cumulative"):
+            if self.customer:
+                cum_diffs_df = self._windowed(cumulative_differences(current_year_obs, prior_year_obs))
+            else:
+                key = ("differences", self.full_url_base_daily(), self.full_url_comparison_year())
+                cum_diffs_df = cumulative_views.totals(
+                    key,
+                    (current_version, prior_version),
+                    lambda: daily_differences(current_year_obs, prior_year_obs)
+                )
+                cum_diffs_df = self._selected(self._windowed(cum_diffs_df)).dropna()
+            if not self.climate_divs:   # BUG: Totals, if I keep them, should apply by date, summing the average of the climate divisions
+                cum_diffs_df["total"] = cum_diffs_df.apply(sum, axis=1)
         self._cumulative = True
         self._differences = True
         self._raw = False
@@ -187,31 +445,35 @@ class ClimatePredictionCenter:
 
     async def cooling_degree_days_cumulative(self, normals: bool):
         if normals:
-            observations = await self.get_normals_daily()
+            _, observations = await self._normals_daily(cumulative=True)
         else:
-            observations = await self.get_current_daily()
+            _, observations = await self._current_daily(cumulative=True)
         self._cumulative = True
         self._raw = False
-        return self.formatted_output(observations.cumsum())
+        return self.formatted_output(self._selected(self._windowed(observations)))
 
     async def cooling_degree_days(self) -> dict:
-        df = await self.get_current_daily()
-        return self.formatted_output(df)
+        _, df = await self._current_daily()
+        return self.formatted_output(self._selected(self._windowed(df)))
 
     async def get_climate_div_county_state_map(self) -> pd.DataFrame:
-        return pd.read_csv("./data/region_id_mapping.csv")
+        return get_reference_data().region_map
 
     async def match_climate_ids_to_states(self, data: pd.DataFrame) -> pd.DataFrame:
-        data = data.reset_index()
-        reference: pd.DataFrame = await self.get_climate_div_county_state_map()
-        data = data.merge(reference, left_on="Region", right_on="Region ID")
-        # formatting the region column so it shows the region name with the region ID in parentheses
-        data["Region"] = data["Name"].str.cat(data['Region'].astype(str).str[-2:].apply(lambda x: f"({x})"), sep=" ")
-        data = data.drop(columns=["CD", "Name", "Region ID"])\
-            .set_index(["ST", "Region"])
-        return data
+        return self._label_regions(data)
+
+    @staticmethod
+    def _label_regions(data: pd.DataFrame) -> pd.DataFrame:
+        # index becomes (state, region name with the region ID in parentheses)
+        with timed("cpc_match_regions"):
+            return get_reference_data().label_regions(data)
 
     def formatted_output(self, dataframe: pd.DataFrame) -> dict:
         self.length = len(dataframe)
-        return {"metadata": self.metadata()} | df_to_list_objs_w_date_indx_as_attr(dataframe, "observations")
+        with timed("cpc_serialize"):
+            if self.columnar:
+                observations = df_to_columns_w_date_indx(dataframe, "observations")
+            else:
+                observations = df_to_list_objs_w_date_indx_as_attr(dataframe, "observations")
+        return {"metadata": self.metadata()} | observations
     
@@ -0,0 +1,123 @@
+"""
+    Daily degree-day frames and their running totals, kept between requests.
+    Frames are reshaped once per version of the CPC file(s) they come from,
+    for every region, so a request against an unchanged file only selects its
+    columns and serializes them. When a file is refreshed it normally just
+    gains the latest day or two; the running totals are then extended by those
+    days instead of summed again from January 1. Anything else (a revised
+    day, a region added or removed) is recomputed in full.
+    Degree days are whole numbers, so extended totals equal recomputed ones
+    exactly.
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from os import getenv
+from typing import Callable, Hashable
+
+import numpy as np
+import pandas as pd
+
+CPC_VIEW_CACHE_SIZE = int(getenv("CPC_VIEW_CACHE_SIZE", 32))
+
+
+def extends(old: pd.DataFrame, new: pd.DataFrame) -> bool:
+    """whether `new` is `old` with rows added at the end"""
+    rows = len(old)
+    return (
+        rows <= len(new)
+        and new.columns.equals(old.columns)
+        and (new.dtypes.to_numpy() == old.dtypes.to_numpy()).all()
+        and new.index[:rows].equals(old.index)
+        and np.array_equal(new.to_numpy()[:rows], old.to_numpy(), equal_nan=True)
+    )
+
+
+def daily_differences(current: pd.DataFrame, prior: pd.DataFrame) -> pd.DataFrame:
+    """
+    `current - prior` on the dates both frames have. Its running total, with
+    NaN rows dropped, is `cumulative_differences(current, prior)`: a date only
+    one frame has is all NaN there. Leaving those dates out keeps today's frame
+    a prefix of tomorrow's
+    """
+    if not current.columns.equals(prior.columns):
+        return current - prior
+    dates = current.index.intersection(prior.index)
+    differences = current.loc[dates] - prior.loc[dates]
+    if len(dates) < len(current.index.union(prior.index)):
+        # the aligned subtraction would be float, to hold NaN for unmatched dates
+        differences = differences.astype(float)
+    return differences
+
+
+@dataclass
+class View:
+    version: Hashable
+    daily: pd.DataFrame
+    totals: pd.DataFrame | None = None
+    # per-column sum of `daily`, NaN skipped: where totals for added days start
+    carry: pd.Series | None = None
+
+
+class CumulativeViews:
+    """
+    LRU mapping of key -> View, bounded to `maxsize` views. The frames are
+    shared between requests and must not be modified in place
+    """
+
+    def __init__(self, maxsize: int = CPC_VIEW_CACHE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.views: OrderedDict[Hashable, View] = OrderedDict()
+        self.extended = 0
+        self.recomputed = 0
+
+    def daily(
+        self, key: Hashable, version: Hashable, prepare: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """the daily frame for `key`, from `prepare` unless it is already held at `version`"""
+        return self._view(key, version, prepare).daily
+
+    def totals(
+        self, key: Hashable, version: Hashable, prepare: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """running totals down each column of the daily frame for `key`"""
+        view = self._view(key, version, prepare)
+        if view.totals is None:
+            self._total(view)
+        return view.totals
+
+    def _view(
+        self, key: Hashable, version: Hashable, prepare: Callable[[], pd.DataFrame]
+    ) -> View:
+        view = self.views.get(key)
+        if view is not None and view.version == version:
+            self.views.move_to_end(key)
+            return view
+        previous, view = view, View(version, prepare())
+        if previous is not None and previous.totals is not None:
+            self._total(view, previous)
+        self.views[key] = view
+        self.views.move_to_end(key)
+        while len(self.views) > self.maxsize:
+            self.views.popitem(last=False)
+        return view
+
+    def _total(self, view: View, previous: View | None = None) -> None:
+        if previous is not None and extends(previous.daily, view.daily):
+            added = view.daily.iloc[len(previous.daily) :]
+            if added.empty:
+                view.totals, view.carry = previous.totals, previous.carry
+            else:
+                view.totals = pd.concat([previous.totals, added.cumsum() + previous.carry])
+                view.carry = previous.carry + added.sum()
+            self.extended += 1
+        else:
+            view.totals = view.daily.cumsum()
+            view.carry = view.daily.sum()
+            self.recomputed += 1
+
+    def clear(self) -> None:
+        self.views.clear()
+
+
+cumulative_views = CumulativeViews()
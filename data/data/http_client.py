@@ -0,0 +1,73 @@
+"""
+    Shared async HTTP client for the upstream data sources (FRED, CPC).
+    One connection pool is kept for the life of the app so requests reuse
+    keep-alive connections, and each upstream host gets a cap on how many
+    requests may be in flight to it at once.
+"""
+
+import asyncio
+from os import getenv
+
+import httpx
+
+from data.data.metrics import upstream_bytes, upstream_responses
+
+MAX_CONNECTIONS = int(getenv("UPSTREAM_MAX_CONNECTIONS", 100))
+MAX_KEEPALIVE = int(getenv("UPSTREAM_MAX_KEEPALIVE", 20))
+KEEPALIVE_EXPIRY = float(getenv("UPSTREAM_KEEPALIVE_EXPIRY", 30))
+TIMEOUT = float(getenv("UPSTREAM_TIMEOUT", 30))
+CONNECT_TIMEOUT = float(getenv("UPSTREAM_CONNECT_TIMEOUT", 5))
+PER_HOST_LIMIT = int(getenv("UPSTREAM_PER_HOST_LIMIT", 10))
+
+
+class UpstreamClient:
+
+    def __init__(
+        self,
+        max_connections: int = MAX_CONNECTIONS,
+        max_keepalive: int = MAX_KEEPALIVE,
+        keepalive_expiry: float = KEEPALIVE_EXPIRY,
+        timeout: float = TIMEOUT,
+        connect_timeout: float = CONNECT_TIMEOUT,
+        per_host_limit: int = PER_HOST_LIMIT,
+    ) -> None:
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.per_host_limit = per_host_limit
+        self.client: httpx.AsyncClient | None = None
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+
+    async def start(self) -> None:
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=self.limits, timeout=self.timeout, follow_redirects=True
+            )
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            self._host_limits.clear()
+
+    async def get(
+        self, url: str, params: dict | None = None, headers: dict | None = None
+    ) -> httpx.Response:
+        # started by the app lifespan, but usable outside of it (scripts, shell)
+        if self.client is None:
+            await self.start()
+        host = httpx.URL(url).host
+        limit = self._host_limits.get(host)
+        if limit is None:
+            limit = self._host_limits[host] = asyncio.Semaphore(self.per_host_limit)
+        async with limit:
+            response = await self.client.get(url, params=params, headers=headers)
+        upstream_responses.inc(host, str(response.status_code))
+        upstream_bytes.inc(host, amount=len(response.content))
+        return response
+
+
+upstream = UpstreamClient()
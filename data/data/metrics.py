@@ -0,0 +1,171 @@
+"""
+    In-process metrics, rendered in the Prometheus text format for /metrics.
+    Recording a value is a lock, a bisect and a couple of additions, cheap
+    enough to leave on in the request path. Values are per process.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30
+)
+Labels = tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()) -> None:
+        super().__init__(name, help, labels)
+        self.values: dict[Labels, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            values = list(self.values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Labels = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [count per bucket (the last is +Inf), sum]
+        self.values: dict[Labels, list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound if bound == "+Inf" else _number(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_label_text(self.labels, labels, le)} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_label_text(self.labels, labels)} {repr(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, labels)} {cumulative}")
+        return lines
+
+
+class Collected(Metric):
+    """A counter or gauge whose values are read from `collect` when rendered,
+    for state that is already counted elsewhere (cache hits, pool sizes)"""
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        collect: Callable[[], dict[Labels, float]],
+        labels: Labels = (),
+        kind: str = "gauge",
+    ) -> None:
+        super().__init__(name, help, labels)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{_label_text(self.labels, labels)} {_number(value)}")
+        return lines
+
+
+registry: list[Metric] = []
+
+
+def render() -> str:
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+stage_seconds = Histogram(
+    "data_api_stage_seconds",
+    "Time spent in each stage of request handling",
+    labels=("stage",),
+)
+request_seconds = Histogram(
+    "data_api_request_seconds",
+    "Request latency by route",
+    labels=("method", "route", "status"),
+)
+upstream_bytes = Counter(
+    "data_api_upstream_bytes_total",
+    "Response body bytes fetched from upstream sources",
+    labels=("host",),
+)
+upstream_responses = Counter(
+    "data_api_upstream_responses_total",
+    "Responses from upstream sources",
+    labels=("host", "status"),
+)
+
+
+def timed(stage: str):
+    """context manager recording the wall time of the block under `stage`"""
+    return stage_seconds.time(stage)
@@ -0,0 +1,96 @@
+"""
+    Reference tables behind the degree-day lookups: climate-division names
+    and the climate divisions covered by each customer's branches.
+    They are read once, at startup, and kept as immutable indexed structures.
+"""
+
+import os
+from dataclasses import dataclass
+from functools import cache
+from logging import getLogger
+from types import MappingProxyType
+from typing import Mapping
+
+import numpy as np
+import pandas as pd
+
+logger = getLogger("uvicorn.info")
+
+REGION_MAP = "./data/region_id_mapping.csv"
+CUSTOMERS = "./data/ga_customers.csv"
+BRANCHES = "./data/ga_branches.csv"
+
+
+@dataclass(frozen=True)
+class ReferenceData:
+    region_map: pd.DataFrame
+    # position-aligned: regions[i] is the (state, "NAME (division)") of region_ids[i]
+    region_ids: pd.Index
+    regions: pd.MultiIndex
+    customer_names: Mapping[int, str]
+    customer_divisions: Mapping[int, np.ndarray]
+
+    @classmethod
+    def load(
+        cls,
+        region_map: str = REGION_MAP,
+        customers: str = CUSTOMERS,
+        branches: str = BRANCHES,
+    ) -> "ReferenceData":
+        reference = pd.read_csv(region_map)
+        # the region name with the region ID's division number in parentheses
+        labels = reference["Name"].str.cat(
+            reference["Region ID"].astype(str).str[-2:].apply(lambda x: f"({x})"),
+            sep=" ",
+        )
+        regions = pd.MultiIndex.from_arrays(
+            [reference["ST"], labels], names=["ST", "Region"]
+        )
+
+        customer_names, customer_divisions = {}, {}
+        if os.path.exists(customers) and os.path.exists(branches):
+            names = pd.read_csv(customers).set_index("ID")["Customer"]
+            customer_names = names.to_dict()
+            branch_table = pd.read_csv(branches, dtype={"Climate Division": int})
+            for customer_id, divisions in branch_table.groupby("company_id")[
+                "Climate Division"
+            ]:
+                divisions = np.array(list(set(divisions.to_list())))
+                divisions.flags.writeable = False
+                customer_divisions[customer_id] = divisions
+        else:
+            logger.warning(
+                "customer reference files not found, customer lookups disabled"
+            )
+
+        return cls(
+            region_map=reference,
+            region_ids=pd.Index(reference["Region ID"]),
+            regions=regions,
+            customer_names=MappingProxyType(customer_names),
+            customer_divisions=MappingProxyType(customer_divisions),
+        )
+
+    def region(self, region_id: int) -> tuple[str, str]:
+        """region ID -> (state, region label)"""
+        return self.regions[self.region_ids.get_loc(region_id)]
+
+    def label_regions(self, data: pd.DataFrame) -> pd.DataFrame:
+        """
+        replace an index of climate-division region IDs with (state, region label),
+        dropping rows for IDs that aren't in the reference table
+        """
+        positions = self.region_ids.get_indexer(data.index)
+        found = positions >= 0
+        if found.all():
+            data = data.copy(deep=False)
+        else:
+            data = data[found]
+            positions = positions[found]
+        data.index = self.regions[positions]
+        return data
+
+
+@cache
+def get_reference_data() -> ReferenceData:
+    return ReferenceData.load()
@@ -0,0 +1,62 @@
+"""
+    Coalescing of identical upstream fetches.
+    While a fetch for a key is in flight, anyone else asking for the same key
+    waits on it rather than starting their own, so a burst of requests for
+    one CPC file or FRED series makes a single trip upstream. The shared
+    result must not be modified by the callers.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from data.data.metrics import Collected
+
+T = TypeVar("T")
+
+flights: list["SingleFlight"] = []
+
+
+class SingleFlight:
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.calls: dict[Hashable, asyncio.Task] = {}
+        self.started = 0
+        self.joined = 0
+        flights.append(self)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        The result of `call()`, or of the call already in flight for `key`.
+        The call runs as its own task, so a caller that is cancelled doesn't
+        cancel it for the others (its result still reaches any cache it fills)
+        """
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.calls[key] = task
+            self.started += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.joined += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        # retrieved here, so a call left without callers isn't reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+
+Collected(
+    "data_api_upstream_fetches_total",
+    "Upstream fetches started, or joined to one already in flight",
+    collect=lambda: {
+        (flight.name, result): count
+        for flight in flights
+        for result, count in (("started", flight.started), ("joined", flight.joined))
+    },
+    labels=("source", "result"),
+    kind="counter",
+)
@@ -0,0 +1,110 @@
+"""
+    On-disk snapshots of CPC degree-day files that no longer change
+    (completed years and the climatology).
+    Each file is stored as a region x day NumPy array plus a small JSON file
+    with the region and date labels. Arrays are opened memory-mapped, so every
+    worker process reading the same snapshot shares one page-cached copy.
+
+    Backfill from the command line with
+        python -m data.data.snapshots 2015-2024
+"""
+
+import json
+import os
+import shutil
+import tempfile
+from os import getenv
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+
+SNAPSHOT_DIR = getenv("CPC_SNAPSHOT_DIR", "./data/snapshots")
+
+
+def parse_years(spec: str) -> list[int]:
+    """'2015-2018,2020' -> [2015, 2016, 2017, 2018, 2020]"""
+    years = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        start, _, end = part.partition("-")
+        years.extend(range(int(start), int(end or start) + 1))
+    return years
+
+
+class SnapshotStore:
+
+    VALUES = "values.npy"
+    META = "meta.json"
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def path(self, url: str) -> str:
+        # <year or climatology period>/<file name>, e.g. 2021/StatesCONUS.Cooling
+        period, file_name = urlsplit(url).path.rsplit("/", 2)[-2:]
+        return os.path.join(self.root, period, file_name.removesuffix(".txt"))
+
+    def __contains__(self, url: str) -> bool:
+        return os.path.exists(os.path.join(self.path(url), self.META))
+
+    def load(self, url: str) -> pd.DataFrame | None:
+        """The snapshot as a read-only DataFrame backed by the memory-mapped array"""
+        path = self.path(url)
+        try:
+            with open(os.path.join(path, self.META)) as meta_file:
+                meta = json.load(meta_file)
+            values = np.load(os.path.join(path, self.VALUES), mmap_mode="r")
+        except FileNotFoundError:
+            return None
+        return pd.DataFrame(
+            values,
+            index=pd.Index(meta["regions"], name="Region"),
+            columns=meta["columns"],
+            copy=False,
+        )
+
+    def save(self, url: str, data: pd.DataFrame) -> None:
+        values = data.to_numpy()
+        int32 = np.iinfo(np.int32)
+        if values.dtype.kind == "i" and (
+            int32.min <= values.min(initial=0) and values.max(initial=0) <= int32.max
+        ):
+            values = values.astype(np.int32)
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written to a temp directory and renamed into place, so a concurrent
+        # reader (or another worker saving the same file) never sees half of it
+        tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+        try:
+            np.save(os.path.join(tmp, self.VALUES), values)
+            with open(os.path.join(tmp, self.META), "w") as meta_file:
+                json.dump(
+                    {
+                        "regions": data.index.tolist(),
+                        "columns": data.columns.tolist(),
+                    },
+                    meta_file,
+                )
+            os.rename(tmp, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, self.META)):
+                raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+
+snapshots = SnapshotStore(SNAPSHOT_DIR)
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    from data.data.climate_prediction_center import backfill_snapshots
+
+    parser = argparse.ArgumentParser(
+        description="Save CPC degree-day files for completed years as snapshots"
+    )
+    parser.add_argument("years", help="years to backfill, e.g. 2015-2020,2022")
+    args = parser.parse_args()
+    asyncio.run(backfill_snapshots(parse_years(args.years)))
@@ -3,8 +3,11 @@ Routes for Cooling Degree Days
 """
 
 import datetime
-from fastapi import APIRouter, HTTPException
-from data.data.climate_prediction_center import ClimatePredictionCenter
+from typing import Awaitable, Callable
+from fastapi import APIRouter, HTTPException, Request, Response
+from data.data import ResponseFormat
+from data.data.climate_prediction_center import ClimatePredictionCenter, is_live
+from data.routes.conditional import conditional_response, cpc_version
 
 cdd = APIRouter(prefix="/cdd", tags=["Cooling Degree Days"])
 
@@ -35,11 +38,31 @@ def valid_year_input(input_year: int) -> bool:
 
     return True
 
+def valid_date_window(
+        start: datetime.date|None,
+        end: datetime.date|None,
+        last_n_days: int|None
+    ) -> bool:
+    if last_n_days is not None and (start or end):
+        raise HTTPException(
+            400,
+            "Use either 'last_n_days' or 'start'/'end', not both"
+        )
+    elif last_n_days is not None and last_n_days < 1:
+        raise HTTPException(400, "'last_n_days' should be a positive number of days")
+    elif start and end and start > end:
+        raise HTTPException(400, "'start' should be on or before 'end'")
+    return True
+
 def init_cpc(
         states: str=None,
         base_year: int=None,
         climate_divisions: bool=False,
-        customer_id: int=None
+        customer_id: int=None,
+        start: datetime.date=None,
+        end: datetime.date=None,
+        last_n_days: int=None,
+        format: ResponseFormat="records"
     ):
     assert any((states, customer_id)), "either a selection of states or a "\
         "customer is required"
@@ -52,40 +75,81 @@ def init_cpc(
         if base_year < 0:
             base_year = abs(base_year)
         assert valid_year_input(base_year)
+    assert valid_date_window(start, end, last_n_days)
 
     return ClimatePredictionCenter(states_split, base_year, 
-                                   climate_divisions, customer_id)
+                                   climate_divisions, customer_id,
+                                   start, end, last_n_days,
+                                   columnar=format == "columnar")
+
+async def cpc_response(
+        request: Request,
+        cpc: ClimatePredictionCenter,
+        content: Callable[[], Awaitable[dict]],
+        differences: bool=False,
+        normals: bool=False
+    ) -> Response:
+    # versioned by the CPC files behind it, checked before any of them is transformed
+    files = await cpc.source_files(differences, normals)
+    return await conditional_response(
+        request,
+        [cpc_version(entry) for entry in files.values()],
+        content,
+        immutable=not any(map(is_live, files))
+    )
 
 ## COOLING DEGREE DAYS (CDD) ##
 @cdd.get("")
 async def get_cooling_degree_days_raw(
+        request: Request,
         states: str|None=None,
         base_year: int|None = None,
         climate_divisions: bool=False,
-        customer_id: int|None=None
+        customer_id: int|None=None,
+        start: datetime.date|None=None,
+        end: datetime.date|None=None,
+        last_n_days: int|None=None,
+        format: ResponseFormat="records"
     ):
-    cpc = init_cpc(states,base_year,climate_divisions,customer_id)
-    return await cpc.cooling_degree_days()
+    cpc = init_cpc(states,base_year,climate_divisions,customer_id,
+                   start,end,last_n_days,format)
+    return await cpc_response(request, cpc, cpc.cooling_degree_days)
 
 
 @cdd.get("/cumulative")
 async def get_cumulative_cdd(
+        request: Request,
         states: str|None=None,
         normals: bool=False,
         base_year: int|None=None,
         climate_divisions: bool=False,
-        customer_id: int|None=None
+        customer_id: int|None=None,
+        start: datetime.date|None=None,
+        end: datetime.date|None=None,
+        last_n_days: int|None=None,
+        format: ResponseFormat="records"
     ):
-    cpc = init_cpc(states,base_year,climate_divisions,customer_id)
-    return await cpc.cooling_degree_days_cumulative(normals)
+    cpc = init_cpc(states,base_year,climate_divisions,customer_id,
+                   start,end,last_n_days,format)
+    return await cpc_response(
+        request, cpc, lambda: cpc.cooling_degree_days_cumulative(normals), normals=normals
+    )
 
 
 @cdd.get("/cumulative-differences")
 async def get_cooling_degree_day_cumulative_differences_yoy(
+        request: Request,
         states: str|None=None,
         base_year: int|None=None,
         climate_divisions: bool=False,
-        customer_id: int|None=None
+        customer_id: int|None=None,
+        start: datetime.date|None=None,
+        end: datetime.date|None=None,
+        last_n_days: int|None=None,
+        format: ResponseFormat="records"
     ):
-    cpc = init_cpc(states,base_year,climate_divisions,customer_id)
-    return await cpc.cooling_degree_days_diff_yoy()
+    cpc = init_cpc(states,base_year,climate_divisions,customer_id,
+                   start,end,last_n_days,format)
+    return await cpc_response(
+        request, cpc, cpc.cooling_degree_days_diff_yoy, differences=True
+    )
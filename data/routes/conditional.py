@@ -0,0 +1,104 @@
+"""
+Conditional GET support for the data routes.
+
+A response's ETag is a hash of the route, its query parameters and the
+version of the upstream data it is built from, so it can be checked before
+any of the data is transformed. A request whose If-None-Match holds the
+current ETag gets an empty 304.
+An ETag fixes the response body, so bodies are also kept by ETag, and a
+request for a view that was already built (or warmed by prefetch.py) is
+answered without building it again.
+"""
+
+import hashlib
+from os import getenv
+from typing import Awaitable, Callable
+
+from fastapi import Request, Response
+from fastapi.responses import ORJSONResponse
+
+from data.data.cache import CacheEntry, TTLCache
+from data.data.metrics import Collected
+
+# data that is still being published is revalidated on every use; completed
+# years and the climatology can be reused for a day without asking
+REVALIDATE = "private, no-cache"
+IMMUTABLE = "private, max-age=86400"
+
+# parameters that don't change the response
+IGNORED_PARAMETERS = {"fred_api_key"}
+
+# a full year of climate divisions renders to hundreds of KB, so the bodies
+# kept are bounded by their total size as well as their number
+RESPONSE_CACHE_SIZE = int(getenv("RESPONSE_CACHE_SIZE", 256))
+RESPONSE_CACHE_BYTES = int(getenv("RESPONSE_CACHE_BYTES", 32 * 1024 * 1024))
+RESPONSE_CACHE_TTL = float(getenv("RESPONSE_CACHE_TTL", 24 * 60 * 60))
+
+rendered = TTLCache(maxsize=RESPONSE_CACHE_SIZE, max_bytes=RESPONSE_CACHE_BYTES)
+Collected(
+    "data_api_response_cache_lookups_total",
+    "Rendered response lookups by ETag; a stale entry counts as a miss",
+    collect=lambda: {("hit",): rendered.hits, ("miss",): rendered.misses},
+    labels=("result",),
+    kind="counter",
+)
+Collected(
+    "data_api_response_cache_bytes",
+    "Bytes of rendered responses kept by ETag",
+    collect=lambda: {(): rendered.bytes},
+)
+
+
+def cpc_version(entry: CacheEntry) -> str:
+    """the upstream validator of a CPC file, or, for a file without one
+    (read from a snapshot), its version in this process's cache"""
+    return entry.etag or entry.last_modified or f"cache-{entry.version}"
+
+
+def fred_version(data: dict) -> str:
+    """FRED moves `realtime_end` when it publishes a vintage, and `count` grows with new observations"""
+    return f"{data.get('realtime_end')}/{data.get('count')}"
+
+
+def etag(request: Request, versions: list[str]) -> str:
+    parameters = sorted(
+        (key, value)
+        for key, value in request.query_params.multi_items()
+        if key not in IGNORED_PARAMETERS
+    )
+    digest = hashlib.sha256(
+        repr((request.url.path, parameters, versions)).encode()
+    ).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def matches(if_none_match: str | None, tag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    candidates = (candidate.strip() for candidate in if_none_match.split(","))
+    return tag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+async def conditional_response(
+    request: Request,
+    versions: list[str],
+    content: Callable[[], Awaitable[dict]],
+    immutable: bool = False,
+) -> Response:
+    """
+    304 if the client holds the current ETag, otherwise the JSON from `content`,
+    rendered once per ETag
+    """
+    tag = etag(request, versions)
+    headers = {"ETag": tag, "Cache-Control": IMMUTABLE if immutable else REVALIDATE}
+    if matches(request.headers.get("if-none-match"), tag):
+        return Response(status_code=304, headers=headers)
+    entry = rendered.get(tag)
+    if entry and entry.fresh():
+        return Response(entry.value, headers=headers, media_type=ORJSONResponse.media_type)
+    response = ORJSONResponse(await content(), headers=headers)
+    rendered.set(tag, response.body, RESPONSE_CACHE_TTL)
+    return response
@@ -1,8 +1,13 @@
-from fastapi import APIRouter, HTTPException
+from os import getenv
+from fastapi import APIRouter, HTTPException, Request
+from data.data import ResponseFormat
 from data.data.FRED import FRED
+from data.routes.conditional import conditional_response, fred_version
 
 fred = APIRouter(prefix="/fred-data", tags=["FRED"])
 
+FRED_BATCH_MAX_SERIES = int(getenv("FRED_BATCH_MAX_SERIES", 50))
+
 def valid_states_input(states: list[str]) -> bool:
     if any(map(lambda e: len(e)!=2 ,states)):
         raise HTTPException(
@@ -12,16 +17,72 @@ def valid_states_input(states: list[str]) -> bool:
         )
     return True
 
+def raise_for_fred_error(series_id: str, data: dict) -> None:
+    """FRED answers an unknown series or a bad api key with an error body in place
+    of observations. Its 4xx status is passed on; anything else is a bad gateway"""
+    missing = f"no observations returned for {series_id}"
+    if "observations" not in data:
+        code = data.get("error_code")
+        raise HTTPException(
+            status_code=code if isinstance(code, int) and 400 <= code < 500 else 502,
+            detail=data.get("error_message", missing),
+        )
+    if not data["observations"]:
+        raise HTTPException(status_code=404, detail=missing)
+
 ### FRED-DATA ###
 @fred.get("")
 async def get_fred_series_with_calculated_data(
+        request: Request,
         series_id: str,
-        fred_api_key: str
+        fred_api_key: str,
+        format: ResponseFormat = "records"
+    ):
+    fred = FRED(api_key=fred_api_key, columnar=format == "columnar")
+    data = await fred.get_data(series_id)
+    raise_for_fred_error(series_id, data)
+    return await conditional_response(
+        request, [fred_version(data)], lambda: fred.series_from_data(data)
+    )
+
+@fred.get("/batch")
+async def get_fred_series_batch(
+        request: Request,
+        series_ids: str,
+        fred_api_key: str,
+        format: ResponseFormat = "records"
     ):
-    fred = FRED(api_key=fred_api_key)
-    return await fred.fred_series(series_id)
+    series_split = [e.strip() for e in series_ids.split(",") if e.strip()]
+    if not series_split or len(series_split) > FRED_BATCH_MAX_SERIES:
+        raise HTTPException(
+            status_code=400,
+            detail="'series_ids' query parameter expects a comma-separated list of "
+                f"1 to {FRED_BATCH_MAX_SERIES} FRED series IDs"
+        )
+    fred = FRED(api_key=fred_api_key, columnar=format == "columnar")
+    responses = await fred.get_data_batch(series_split)
+    # a failed series is part of the version, so the response is rebuilt once it succeeds
+    versions = [
+        f"{series_id}:" + (repr(data) if isinstance(data, Exception) else fred_version(data))
+        for series_id, data in responses.items()
+    ]
+    return await conditional_response(
+        request, versions, lambda: fred.series_batch_from_data(responses)
+    )
 
 @fred.get("/housing-inventory")
-async def housing_inventory_by_state(state: str, fred_api_key: str):
-    fred = FRED(api_key=fred_api_key)
-    return await fred.housing_inventory_by_state(state)
+async def housing_inventory_by_state(
+        request: Request,
+        state: str,
+        fred_api_key: str,
+        format: ResponseFormat = "records"
+    ):
+    fred = FRED(api_key=fred_api_key, columnar=format == "columnar")
+    active, pending = await fred.get_housing_inventory_data(state)
+    raise_for_fred_error("ACTLISCOU" + state, active)
+    raise_for_fred_error("PENLISCOU" + state, pending)
+    return await conditional_response(
+        request,
+        [fred_version(active), fred_version(pending)],
+        lambda: fred.housing_inventory_from_data(active, pending),
+    )
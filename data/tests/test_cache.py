@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+
+from data.data.cache import TTLCache
+from data.data.climate_prediction_center import (
+    ClimatePredictionCenter,
+    cpc_files,
+    fetch_cpc_file,
+    read_cpc_file,
+)
+from data.data.http_client import upstream
+
+
+def test_bounded_by_bytes():
+    cache = TTLCache(maxsize=10, max_bytes=10)
+    cache.set("a", b"1234", ttl=60)
+    cache.set("b", b"1234", ttl=60)
+    cache.set("c", b"1234", ttl=60)
+    # least recently used first
+    assert list(cache.entries) == ["b", "c"]
+    assert cache.bytes == 8
+
+    cache.set("b", b"12", ttl=60)
+    assert list(cache.entries) == ["c", "b"]
+    assert cache.bytes == 6
+
+    # too big to keep at all, and doesn't push anything out
+    cache.set("d", b"12345678901", ttl=60)
+    assert list(cache.entries) == ["c", "b"]
+
+    cache.discard("c")
+    assert cache.bytes == 2
+    cache.clear()
+    assert cache.bytes == 0 and not cache.entries
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1, ttl=60)
+    cache.set("b", 2, ttl=60)
+    cache.get("a")
+    cache.set("c", 3, ttl=60)
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.get("b") is None
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("data.data.cache.monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1, ttl=60)
+
+    assert cache.get("a").fresh()
+    now[0] += 61
+    # a stale entry is still returned, for revalidation, but counted as a miss
+    entry = cache.get("a")
+    assert entry.value == 1 and not entry.fresh()
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    entry.renew(60)
+    assert cache.get("a").fresh()
+
+
+CPC_FILE = (
+    b"Cooling Degree Days\n"
+    b"Population weighted\n"
+    b"\n"
+    b"Region|20260101|20260102\n"
+    b"GA|0|3\n"
+    b"FL|5|8\n"
+)
+
+
+def test_stale_cpc_file_is_revalidated(monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(
+            200,
+            content=CPC_FILE,
+            headers={"ETag": '"v1"', "Last-Modified": "Sat, 17 Oct 2026 12:00:00 GMT"},
+        )
+
+    url = ClimatePredictionCenter.BASE_URL + ClimatePredictionCenter.LATEST + "States.txt"
+    cpc_files.clear()
+
+    async def reads():
+        monkeypatch.setattr(
+            upstream, "client", httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        )
+        first = await fetch_cpc_file(url)
+        fresh = await fetch_cpc_file(url)
+        first.expires = 0
+        revalidated = await fetch_cpc_file(url)
+        frame = await read_cpc_file(url)
+        await upstream.client.aclose()
+        return first, fresh, revalidated, frame
+
+    first, fresh, revalidated, frame = asyncio.run(reads())
+    cpc_files.clear()
+
+    # fetched once, then only revalidated once it went stale
+    assert len(requests) == 2
+    assert "if-none-match" not in requests[0].headers
+    assert requests[1].headers["if-none-match"] == '"v1"'
+    assert requests[1].headers["if-modified-since"] == "Sat, 17 Oct 2026 12:00:00 GMT"
+    # the 304 renewed the cached frame instead of replacing it
+    assert fresh is first and revalidated is first
+    assert revalidated.fresh() and revalidated.version == first.version
+    assert frame.loc["FL", "20260102"] == 8
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+from fastapi.responses import ORJSONResponse
+
+from data.data import df_to_columns_w_date_indx
+
+DATES = pd.date_range("2026-01-01", periods=3)
+
+
+def body(df: pd.DataFrame) -> bytes:
+    return ORJSONResponse(df_to_columns_w_date_indx(df, "observations")).body
+
+
+def test_uniform_dtype():
+    df = pd.DataFrame({"GA": [0, 3, 5], "FL": [4, 8, 9]}, index=DATES)
+
+    assert body(df) == (
+        b'{"observations":{"dates":["2026-01-01","2026-01-02","2026-01-03"],'
+        b'"values":{"GA":[0,3,5],"FL":[4,8,9]}}}'
+    )
+
+
+def test_mixed_int_and_float_columns():
+    # states keep their integer degree days next to a float total
+    df = pd.DataFrame({"GA": [0, 3, 5], "FL": [4, 8, 9]}, index=DATES)
+    df["total"] = df.sum(axis=1) / 2
+
+    assert body(df) == (
+        b'{"observations":{"dates":["2026-01-01","2026-01-02","2026-01-03"],'
+        b'"values":{"GA":[0,3,5],"FL":[4,8,9],"total":[2.0,5.5,7.0]}}}'
+    )
+
+
+def test_climate_divisions_nested_by_state():
+    columns = pd.MultiIndex.from_tuples(
+        [("GA", "NORTH (01)"), ("GA", "SOUTH (02)"), ("FL", "KEYS (07)")]
+    )
+    df = pd.DataFrame(np.arange(9).reshape(3, 3), index=DATES, columns=columns)
+
+    assert body(df) == (
+        b'{"observations":{"dates":["2026-01-01","2026-01-02","2026-01-03"],'
+        b'"values":{"GA":{"NORTH (01)":[0,3,6],"SOUTH (02)":[1,4,7]},'
+        b'"FL":{"KEYS (07)":[2,5,8]}}}}'
+    )
+
+
+def test_nan_is_null_and_text_columns_are_lists():
+    df = pd.DataFrame(
+        {
+            "realtime_start": ["2023-02-17"] * 3,
+            "value": [1.5, np.nan, 2.5],
+        },
+        index=DATES,
+    )
+
+    assert body(df) == (
+        b'{"observations":{"dates":["2026-01-01","2026-01-02","2026-01-03"],'
+        b'"values":{"realtime_start":["2023-02-17","2023-02-17","2023-02-17"],'
+        b'"value":[1.5,null,2.5]}}}'
+    )
+
+
+def test_empty_frames():
+    no_rows = pd.DataFrame(
+        {"GA": pd.Series([], dtype="int64")}, index=pd.DatetimeIndex([])
+    )
+    assert body(no_rows) == b'{"observations":{"dates":[],"values":{"GA":[]}}}'
+
+    no_columns = pd.DataFrame(index=DATES)
+    assert body(no_columns) == (
+        b'{"observations":{"dates":["2026-01-01","2026-01-02","2026-01-03"],'
+        b'"values":{}}}'
+    )
@@ -0,0 +1,128 @@
+import asyncio
+import datetime
+
+import orjson
+import pytest
+from fastapi import Request
+
+from data.data.cache import CacheEntry
+from data.data.climate_prediction_center import ClimatePredictionCenter
+from data.routes.cdd import cpc_response
+from data.routes.conditional import (
+    IMMUTABLE,
+    REVALIDATE,
+    conditional_response,
+    etag,
+    matches,
+    rendered,
+)
+
+
+def request(query: str = "", if_none_match: str | None = None, path: str = "/cdd") -> Request:
+    headers = [(b"if-none-match", if_none_match.encode())] if if_none_match else []
+    return Request(
+        {
+            "type": "http",
+            "method": "GET",
+            "path": path,
+            "query_string": query.encode(),
+            "headers": headers,
+        }
+    )
+
+
+@pytest.fixture(autouse=True)
+def empty_response_cache():
+    rendered.clear()
+    yield
+    rendered.clear()
+
+
+@pytest.mark.parametrize(
+    "if_none_match, expected",
+    [
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", W/"abc"', True),
+        ('"xyz","abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+        ('"ab"', False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_matches(if_none_match, expected):
+    assert matches(if_none_match, '"abc"') is expected
+
+
+def test_etag_ignores_fred_api_key_and_parameter_order():
+    tag = etag(request("series_id=GANA&fred_api_key=one", path="/fred-data"), ["v1"])
+    assert tag == etag(request("fred_api_key=two&series_id=GANA", path="/fred-data"), ["v1"])
+    assert tag != etag(request("series_id=UNRATE&fred_api_key=one", path="/fred-data"), ["v1"])
+    assert tag != etag(request("series_id=GANA&fred_api_key=one", path="/fred-data"), ["v2"])
+    assert tag != etag(request("series_id=GANA&fred_api_key=one", path="/fred-data/batch"), ["v1"])
+
+
+def test_current_etag_gets_an_empty_304():
+    calls = []
+
+    async def content():
+        calls.append(1)
+        return {"observations": [1, 2, 3]}
+
+    async def respond(if_none_match=None):
+        return await conditional_response(
+            request("states=GA", if_none_match), ["v1"], content, immutable=True
+        )
+
+    first = asyncio.run(respond())
+    assert first.status_code == 200
+    assert orjson.loads(first.body) == {"observations": [1, 2, 3]}
+
+    tag = first.headers["etag"]
+    not_modified = asyncio.run(respond(f"W/{tag}"))
+    assert not_modified.status_code == 304
+    assert not_modified.body == b""
+    assert not_modified.headers["etag"] == tag
+    assert not_modified.headers["cache-control"] == IMMUTABLE
+
+    # a stale tag gets the body again, from the rendered cache
+    again = asyncio.run(respond('"stale"'))
+    assert again.status_code == 200 and again.body == first.body
+    assert calls == [1]
+
+
+class FakeCPC:
+    """stands in for ClimatePredictionCenter.source_files"""
+
+    def __init__(self, *periods: str) -> None:
+        base = ClimatePredictionCenter.BASE_URL
+        self.files = {
+            base + period + ClimatePredictionCenter.STATES_COOLING: CacheEntry(
+                value=None, expires=0, etag=f'"{period}"'
+            )
+            for period in periods
+        }
+
+    async def source_files(self, differences=False, normals=False):
+        return self.files
+
+
+@pytest.mark.parametrize(
+    "periods, cache_control",
+    [
+        (("2020/",), IMMUTABLE),
+        (("2020/", "2019/"), IMMUTABLE),
+        ((ClimatePredictionCenter.NORMALS,), IMMUTABLE),
+        ((ClimatePredictionCenter.LATEST,), REVALIDATE),
+        ((ClimatePredictionCenter.LATEST, "2020/"), REVALIDATE),
+        ((f"{datetime.datetime.now().year}/",), REVALIDATE),
+    ],
+)
+def test_cache_control_for_completed_and_live_data(periods, cache_control):
+    async def content():
+        return {}
+
+    response = asyncio.run(cpc_response(request("states=GA"), FakeCPC(*periods), content))
+    assert response.headers["cache-control"] == cache_control
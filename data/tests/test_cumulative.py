@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from pandas.testing import assert_frame_equal
+
+from data.data import cumulative_differences
+from data.data.cumulative import CumulativeViews, daily_differences
+
+
+def degree_days(start: str, days: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame(
+        rng.integers(0, 30, size=(days, 3)),
+        index=pd.date_range(start, periods=days),
+        columns=["GA", "FL", "AL"],
+    )
+
+
+def test_appended_days_extend_the_totals():
+    views = CumulativeViews()
+    full = degree_days("2026-01-01", 60)
+    views.totals("current", 1, lambda: full.iloc[:58])
+
+    totals = views.totals("current", 2, lambda: full)
+
+    assert_frame_equal(totals, full.cumsum(), check_exact=True)
+    assert (views.extended, views.recomputed) == (1, 1)
+
+
+def test_new_version_without_added_days_keeps_the_totals():
+    views = CumulativeViews()
+    data = degree_days("2026-01-01", 60)
+    first = views.totals("current", 1, lambda: data)
+
+    assert views.totals("current", 2, lambda: data.copy()) is first
+    assert (views.extended, views.recomputed) == (1, 1)
+
+
+def test_revised_day_recomputes_the_totals():
+    views = CumulativeViews()
+    data = degree_days("2026-01-01", 60)
+    views.totals("current", 1, lambda: data)
+    revised = data.copy()
+    revised.iloc[10, 0] += 5
+    revised = pd.concat([revised, degree_days("2026-03-02", 1, seed=1)])
+
+    totals = views.totals("current", 2, lambda: revised)
+
+    assert_frame_equal(totals, revised.cumsum(), check_exact=True)
+    assert (views.extended, views.recomputed) == (0, 2)
+
+
+def test_differences_on_mismatched_dates():
+    # the prior year is missing days the current year has, and the other way around
+    current = degree_days("2025-01-01", 40)
+    prior = degree_days("2025-01-05", 40, seed=1)
+
+    differences = daily_differences(current, prior)
+
+    assert differences.dtypes.eq(float).all()
+    expected = cumulative_differences(current, prior)
+    views = CumulativeViews()
+    assert_frame_equal(
+        views.totals("differences", 1, lambda: differences).dropna(),
+        expected,
+        check_exact=True,
+    )
+
+    # a day appended to the current year extends the same totals
+    longer = pd.concat([current, degree_days("2025-02-10", 1, seed=2)])
+    totals = views.totals("differences", 2, lambda: daily_differences(longer, prior))
+    assert_frame_equal(
+        totals.dropna(), cumulative_differences(longer, prior), check_exact=True
+    )
+    assert views.extended == 1
+
+
+def test_differences_on_matching_dates_keep_their_dtype():
+    current = degree_days("2025-01-01", 40)
+    prior = degree_days("2025-01-01", 40, seed=1)
+
+    differences = daily_differences(current, prior)
+
+    assert_frame_equal(differences, current - prior, check_exact=True)
+    assert_frame_equal(
+        differences.cumsum().dropna(),
+        cumulative_differences(current, prior),
+        check_exact=True,
+    )
@@ -0,0 +1,148 @@
+import asyncio
+
+import httpx
+import pandas as pd
+import pytest
+from fastapi import FastAPI
+
+from data.data.FRED import FRED, fred_hot
+from data.routes import fred
+
+
+def fred_response(values: list[str]) -> dict:
+    dates = pd.date_range("2020-01-01", periods=len(values), freq="MS")
+    return {
+        "realtime_start": "2023-02-17",
+        "realtime_end": "2023-02-17",
+        "count": len(values),
+        "observations": [
+            {
+                "realtime_start": "2023-02-17",
+                "realtime_end": "2023-02-17",
+                "date": date.strftime("%Y-%m-%d"),
+                "value": value,
+            }
+            for date, value in zip(dates, values)
+        ],
+    }
+
+
+def test_batch_isolates_failing_series(monkeypatch):
+    good = fred_response([str(100 + i) for i in range(30)])
+    responses = {
+        "GOOD": good,
+        "NO_OBSERVATIONS": {"error_code": 400, "error_message": "Bad Request."},
+        "EMPTY": {"count": 0, "observations": []},
+    }
+
+    async def get_data(self, series_id: str) -> dict:
+        if series_id == "RAISES":
+            raise ValueError("upstream failed")
+        return responses[series_id]
+
+    monkeypatch.setattr(FRED, "get_data", get_data)
+    fred = FRED(api_key="x")
+    result = asyncio.run(
+        fred.fred_series_batch(["GOOD", "RAISES", "NO_OBSERVATIONS", "EMPTY"])
+    )
+
+    assert list(result["series"]) == ["GOOD"]
+    assert result["errors"] == {
+        "RAISES": "upstream failed",
+        "NO_OBSERVATIONS": "Bad Request.",
+        "EMPTY": "no observations returned",
+    }
+    # the same as the series requested on its own
+    assert result["series"]["GOOD"] == asyncio.run(
+        fred.series_from_data(fred_response([str(100 + i) for i in range(30)]))
+    )
+
+
+def test_hot_series_served_only_to_the_key_that_fetched_it(monkeypatch):
+    monkeypatch.setattr("data.data.FRED.FRED_HOT_SERIES", ("HOT",))
+    fred_hot.clear()
+    downloads = []
+
+    async def download(self, series_id: str) -> dict:
+        downloads.append(self.api_key)
+        if self.api_key == "valid":
+            return fred_response(["1", "2", "3"])
+        return {"error_code": 400, "error_message": "Bad Request. The value for variable api_key is not registered."}
+
+    monkeypatch.setattr(FRED, "download", download)
+
+    async def requests():
+        first = await FRED(api_key="valid").get_data("HOT")
+        again = await FRED(api_key="valid").get_data("HOT")
+        other = await FRED(api_key="revoked").get_data("HOT")
+        return first, again, other
+
+    first, again, other = asyncio.run(requests())
+    assert again is first
+    assert "observations" not in other
+    assert downloads == ["valid", "revoked"]
+    assert list(fred_hot.entries) == [("valid", "HOT")]
+    fred_hot.clear()
+
+
+def fred_app(monkeypatch, responses: dict[str, dict]) -> FastAPI:
+    async def get_data(self, series_id: str) -> dict:
+        return responses[series_id]
+
+    monkeypatch.setattr(FRED, "get_data", get_data)
+    app = FastAPI()
+    app.include_router(fred)
+    return app
+
+
+def get(app: FastAPI, url: str) -> httpx.Response:
+    async def request():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return await client.get(url)
+
+    return asyncio.run(request())
+
+
+@pytest.mark.parametrize(
+    "response, status, detail",
+    [
+        (
+            {
+                "error_code": 400,
+                "error_message": "Bad Request. The series does not exist.",
+            },
+            400,
+            "Bad Request. The series does not exist.",
+        ),
+        (
+            {"error_code": 500, "error_message": "Internal Server Error"},
+            502,
+            "Internal Server Error",
+        ),
+        ({"count": 0, "observations": []}, 404, "no observations returned for UNKNOWN"),
+    ],
+)
+def test_fred_errors_are_client_errors_not_500s(monkeypatch, response, status, detail):
+    app = fred_app(
+        monkeypatch,
+        {
+            "UNKNOWN": response,
+            "ACTLISCOUGA": fred_response(["1", "2", "3"]),
+            "PENLISCOUGA": response,
+        },
+    )
+
+    single = get(app, "/fred-data?series_id=UNKNOWN&fred_api_key=x")
+    assert (single.status_code, single.json()["detail"]) == (status, detail)
+
+    inventory = get(app, "/fred-data/housing-inventory?state=GA&fred_api_key=x")
+    assert inventory.status_code == status
+    assert inventory.json()["detail"] == detail.replace("UNKNOWN", "PENLISCOUGA")
+
+
+def test_fred_series_route(monkeypatch):
+    app = fred_app(monkeypatch, {"GOOD": fred_response(["1", "2", "3"])})
+
+    response = get(app, "/fred-data?series_id=GOOD&fred_api_key=x")
+    assert response.status_code == 200
+    assert len(response.json()["observations"]) == 3
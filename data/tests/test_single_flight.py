@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+from data.data.single_flight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"value": 1}
+
+    async def callers():
+        return await asyncio.gather(*(flight.do("url", fetch) for _ in range(10)))
+
+    results = asyncio.run(callers())
+    assert calls == [1]
+    assert all(result is results[0] for result in results)
+    assert (flight.started, flight.joined) == (1, 9)
+    assert flight.calls == {}
+
+
+def test_key_released_after_an_exception():
+    flight = SingleFlight("test")
+    attempts = []
+
+    async def fetch():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        if len(attempts) == 1:
+            raise OSError("upstream down")
+        return "ok"
+
+    async def callers():
+        first = await asyncio.gather(
+            flight.do("url", fetch), flight.do("url", fetch), return_exceptions=True
+        )
+        assert flight.calls == {}
+        return first, await flight.do("url", fetch)
+
+    first, retry = asyncio.run(callers())
+    assert [type(result) for result in first] == [OSError, OSError]
+    assert retry == "ok"
+    assert len(attempts) == 2
+    assert flight.calls == {}
+
+
+@pytest.mark.parametrize("cancelled", [0, 1])
+def test_cancelled_caller_does_not_cancel_the_shared_call(cancelled):
+    flight = SingleFlight("test")
+    finished = []
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        finished.append(1)
+        return "ok"
+
+    async def callers():
+        waiters = [asyncio.ensure_future(flight.do("url", fetch)) for _ in range(2)]
+        await asyncio.sleep(0.005)
+        waiters[cancelled].cancel()
+        other = waiters[1 - cancelled]
+        result = await other
+        with pytest.raises(asyncio.CancelledError):
+            await waiters[cancelled]
+        return result
+
+    assert asyncio.run(callers()) == "ok"
+    assert finished == [1]
+    assert flight.calls == {}
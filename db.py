@@ -1,12 +1,39 @@
 from dotenv import load_dotenv
 
 load_dotenv()
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from os import getenv
+from typing import Any, Callable, TypeVar
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
+T = TypeVar("T")
+
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(getenv("DB_POOL_RECYCLE", 30 * 60))
+DB_POOL_PRE_PING = getenv("DB_POOL_PRE_PING", "true").lower() in (
+    "1", "true", "yes"
+)
+# one thread per connection the pool can hand out, so no thread waits on the pool
+DB_EXECUTOR_WORKERS = int(
+    getenv("DB_EXECUTOR_WORKERS", DB_POOL_SIZE + DB_MAX_OVERFLOW)
+)
+
 db_url = getenv("DATABASE_URL").replace("postgres://", "postgresql://")
-engine = create_engine(db_url)
+pool_options = dict(pool_pre_ping=DB_POOL_PRE_PING, pool_recycle=DB_POOL_RECYCLE)
+if not db_url.startswith("sqlite"):
+    # sqlite's pools aren't sized
+    pool_options |= dict(
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+engine = create_engine(db_url, **pool_options)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 
@@ -18,3 +45,55 @@ def get_db():
         print(e)
     finally:
         db.close()
+
+
+class DatabaseExecutor:
+    """
+    Threads for blocking database work, kept apart from asyncio's default
+    executor so that a slow database can't take the threads other blocking
+    work (parsing, file IO) runs on, and the event loop never waits on it
+    """
+
+    def __init__(self, max_workers: int = DB_EXECUTOR_WORKERS) -> None:
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix="db")
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+
+    async def run(self, call: Callable[..., T], *args: Any) -> T:
+        # dequeued exactly once: when the call starts, or when a cancelled
+        # caller takes it back before it did
+        ticket = [False]
+        with self._lock:
+            self.queued += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, partial(self._call, ticket, call, *args)
+            )
+        finally:
+            self._dequeue(ticket)
+
+    def _dequeue(self, ticket: list[bool]) -> None:
+        with self._lock:
+            if not ticket[0]:
+                ticket[0] = True
+                self.queued -= 1
+
+    def _call(self, ticket: list[bool], call: Callable[..., T], *args: Any) -> T:
+        self._dequeue(ticket)
+        with self._lock:
+            self.running += 1
+        try:
+            return call(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+
+db_executor = DatabaseExecutor()
+
+
+async def run_in_db(call: Callable[..., T], *args: Any) -> T:
+    """`call(*args)` on a database thread"""
+    return await db_executor.run(call, *args)
@@ -0,0 +1,233 @@
+"""Background refresh of upstream data and warming of popular views.
+
+Started by the app lifespan so that the first request after an upstream
+update doesn't pay for downloading, parsing and reshaping it:
+    - the CPC latest/ files are revalidated every CPC_PUBLISH_POLL seconds
+      during CPC_PUBLISH_WINDOW, and often enough outside of it that the
+      cached copies never go stale
+    - FRED_HOT_SERIES are fetched again every FRED_HOT_INTERVAL seconds
+    - whenever a latest/ file changes, the /cdd requests made most often over
+      the last PREFETCH_LOG_DAYS days (from data_api_request_log) are built
+      again, so their responses are waiting under the new ETag
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+import asyncio
+import datetime
+import inspect
+from datetime import UTC
+from os import getenv
+from logging import getLogger
+
+from fastapi import Request
+from fastapi.routing import APIRoute
+from pydantic import parse_obj_as
+from sqlalchemy import bindparam, text
+from sqlalchemy.orm import Session
+
+from data.data.climate_prediction_center import (
+    CPC_LIVE_TTL,
+    ClimatePredictionCenter,
+    fetch_cpc_file,
+)
+from data.data.FRED import FRED, FRED_HOT_SERIES, fred_hot
+from data.routes import cdd
+from db import get_db, run_in_db
+
+logger = getLogger("uvicorn.info")
+
+PREFETCH_ENABLED = getenv("PREFETCH_ENABLED", "true").lower() in ("1", "true", "yes")
+# when the day's files are posted, as HH:MM-HH:MM in UTC
+CPC_PUBLISH_WINDOW = getenv("CPC_PUBLISH_WINDOW", "11:00-15:00")
+CPC_PUBLISH_POLL = float(getenv("CPC_PUBLISH_POLL", 10 * 60))
+FRED_HOT_INTERVAL = float(getenv("FRED_HOT_INTERVAL", 60 * 60))
+PREFETCH_POPULAR_VIEWS = int(getenv("PREFETCH_POPULAR_VIEWS", 20))
+PREFETCH_LOG_DAYS = float(getenv("PREFETCH_LOG_DAYS", 7))
+
+
+def parse_window(window: str) -> tuple[datetime.time, datetime.time]:
+    start, end = window.split("-")
+    return datetime.time.fromisoformat(start.strip()), datetime.time.fromisoformat(end.strip())
+
+
+def seconds_until_refresh(
+    now: datetime.datetime,
+    window: tuple[datetime.time, datetime.time],
+    poll: float,
+    ttl: float,
+) -> float:
+    """
+    `poll` seconds inside the publish window. Outside of it, until the window
+    opens, but no more than half of `ttl` so the cached files stay fresh
+    """
+    start, end = window
+    time = now.time().replace(tzinfo=None)
+    inside = start <= time < end if start <= end else (time >= start or time < end)
+    if inside:
+        return poll
+    opens = datetime.datetime.combine(now.date(), start, tzinfo=now.tzinfo)
+    if opens <= now:
+        opens += datetime.timedelta(days=1)
+    return min((opens - now).total_seconds(), ttl / 2)
+
+
+class Prefetcher:
+    """
+    Workers that keep the CPC latest/ files and FRED_HOT_SERIES fresh in
+    memory, and rebuild the popular /cdd views when a latest/ file changes.
+    A view is built by calling its route directly, without the middleware or
+    the access gate, so warming doesn't show up in the request log.
+    """
+
+    def __init__(
+        self,
+        routes: list,
+        window: str = CPC_PUBLISH_WINDOW,
+        poll: float = CPC_PUBLISH_POLL,
+        hot_series: tuple[str, ...] = FRED_HOT_SERIES,
+        hot_interval: float = FRED_HOT_INTERVAL,
+        popular_views: int = PREFETCH_POPULAR_VIEWS,
+        log_days: float = PREFETCH_LOG_DAYS,
+    ) -> None:
+        self.routes = {route.path: route for route in routes if isinstance(route, APIRoute)}
+        self.window = parse_window(window)
+        self.poll = poll
+        self.hot_series = hot_series
+        self.hot_interval = hot_interval
+        self.popular_views = popular_views
+        self.log_days = log_days
+        # url -> cache version of the latest/ files when they were last warmed
+        self.versions: dict[str, int] = {}
+        self._workers: list[asyncio.Task] = []
+
+    async def start(self) -> None:
+        if self._workers:
+            return
+        self._workers.append(asyncio.create_task(self._run_cpc()))
+        if self.hot_series:
+            self._workers.append(asyncio.create_task(self._run_fred()))
+
+    async def stop(self) -> None:
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+
+    async def _run_cpc(self) -> None:
+        while True:
+            if await self.refresh_cpc():
+                await self.warm_views()
+            now = datetime.datetime.now(UTC)
+            await asyncio.sleep(
+                seconds_until_refresh(now, self.window, self.poll, CPC_LIVE_TTL)
+            )
+
+    async def _run_fred(self) -> None:
+        while True:
+            await self.refresh_fred()
+            await asyncio.sleep(self.hot_interval)
+
+    async def refresh_cpc(self) -> bool:
+        """Revalidate the latest/ files; whether any of them changed since last time"""
+        cpc = ClimatePredictionCenter
+        changed = False
+        for file_name in (cpc.STATES_COOLING, cpc.CLIMATE_DIVS_COOLING):
+            url = cpc.BASE_URL + cpc.LATEST + file_name
+            try:
+                entry = await fetch_cpc_file(url, refresh=True)
+            except Exception as e:
+                logger.warning(f"prefetch of {url} failed: {e}")
+                continue
+            changed |= self.versions.get(url) != entry.version
+            self.versions[url] = entry.version
+        return changed
+
+    async def refresh_fred(self) -> None:
+        # the server's key, and every key holding a copy of a hot series
+        server_key = FRED().api_key
+        targets = dict.fromkeys(
+            [(server_key, series_id) for series_id in self.hot_series]
+            + list(fred_hot.entries)
+        )
+        # one at a time, to stay well inside FRED's rate limit
+        for api_key, series_id in targets:
+            try:
+                data = await FRED(api_key=api_key).refresh(series_id)
+            except Exception as e:
+                logger.warning(f"prefetch of FRED series {series_id} failed: {e}")
+                continue
+            if "observations" not in data and api_key == server_key:
+                logger.warning(
+                    f"prefetch of FRED series {series_id} failed: "
+                    f"{data.get('error_message', 'no observations returned')}"
+                )
+
+    async def warm_views(self) -> None:
+        if not self.routes or self.popular_views < 1:
+            return
+        try:
+            views = await run_in_db(self._read_popular_views)
+        except Exception as e:
+            logger.error(f"could not read popular views from the request log: {e}")
+            return
+        for path, parameters in views:
+            try:
+                await self.build(path, parameters)
+            except Exception as e:
+                logger.info(f"could not warm {path}?{parameters}: {e}")
+
+    async def build(self, path: str, parameters: str) -> None:
+        """Build the response to GET `path`?`parameters` the way its route does,
+        which leaves the rendered response cached under its ETag"""
+        route = self.routes[path]
+        request = Request(
+            {
+                "type": "http",
+                "method": "GET",
+                "path": path,
+                "query_string": parameters.encode(),
+                "headers": [],
+            }
+        )
+        query = request.query_params
+        arguments = {}
+        for name, parameter in inspect.signature(route.endpoint).parameters.items():
+            if parameter.annotation is Request:
+                arguments[name] = request
+            elif name in query:
+                # the same conversion FastAPI applies to query parameters
+                arguments[name] = parse_obj_as(parameter.annotation, query[name])
+        await route.endpoint(**arguments)
+
+    def _read_popular_views(self) -> list[tuple[str, str]]:
+        sql = text(
+            """
+            SELECT path, parameters, COUNT(*) AS requests
+            FROM data_api_request_log
+            WHERE path IN :paths
+            AND time > :since
+            GROUP BY path, parameters
+            ORDER BY requests DESC
+            LIMIT :limit
+            """
+        ).bindparams(bindparam("paths", expanding=True))
+        params = dict(
+            paths=list(self.routes),
+            since=datetime.datetime.now(UTC) - datetime.timedelta(days=self.log_days),
+            limit=self.popular_views,
+        )
+        db: Session = next(get_db())
+        try:
+            rows = db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+        return [(path, parameters) for path, parameters, _ in rows]
+
+
+prefetcher = Prefetcher(cdd.routes)
@@ -0,0 +1,164 @@
+"""Background writer for the API request log.
+
+Requests are queued in memory and written to data_api_request_log in
+multi-row batches by a single worker task, so logging a call never puts a
+database round trip in front of the request itself.
+"""
+
+from dotenv import load_dotenv
+
+load_dotenv()
+import asyncio
+from os import getenv
+from typing import Any
+from logging import getLogger
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from db import get_db, run_in_db
+
+logger = getLogger("uvicorn.info")
+
+QUEUE_SIZE = int(getenv("REQUEST_LOG_QUEUE_SIZE", 10_000))
+BATCH_SIZE = int(getenv("REQUEST_LOG_BATCH_SIZE", 500))
+FLUSH_INTERVAL = float(getenv("REQUEST_LOG_FLUSH_INTERVAL", 2.0))
+OVERFLOW_POLICY = getenv("REQUEST_LOG_OVERFLOW_POLICY", "drop_newest")
+
+COLUMNS = ("agent", "path", "parameters", "ip", "time")
+
+
+class RequestLogWriter:
+    """
+    Bounded queue of request log rows drained by one worker.
+
+    A batch is written once `batch_size` rows are waiting or `flush_interval`
+    seconds have passed since the first row of the batch arrived, whichever
+    comes first. When the queue is full the `overflow_policy` decides what
+    happens to a new row:
+        drop_newest - discard the new row
+        drop_oldest - discard the oldest queued row to make room
+        block       - make the request wait for room (backpressure)
+    """
+
+    POLICIES = ("drop_newest", "drop_oldest", "block")
+
+    def __init__(
+        self,
+        max_queue: int = QUEUE_SIZE,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        overflow_policy: str = OVERFLOW_POLICY,
+    ) -> None:
+        if overflow_policy not in self.POLICIES:
+            raise ValueError(
+                f"overflow_policy must be one of {self.POLICIES}, "
+                f"got {overflow_policy!r}"
+            )
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.dropped = 0
+        self._reported_dropped = 0
+        self.queue: asyncio.Queue | None = None
+        self._batch: list[dict[str, Any]] = []
+        self._worker: asyncio.Task | None = None
+        self._flushing: asyncio.Future | None = None
+
+    async def start(self) -> None:
+        if self._worker:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the worker and write everything still held in memory"""
+        if not self._worker:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._flushing:
+            await self._flushing
+        remaining, self._batch = self._batch, []
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        for i in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[i : i + self.batch_size])
+
+    async def record(self, row: dict[str, Any]) -> None:
+        if not self._worker:
+            await self.start()
+        if self.overflow_policy == "block":
+            await self.queue.put(row)
+            return
+        if self.queue.full():
+            self.dropped += 1
+            if self.overflow_policy == "drop_newest":
+                return
+            self.queue.get_nowait()
+        self.queue.put_nowait(row)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch.append(await self.queue.get())
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.batch_size:
+                if not self.queue.empty():
+                    self._batch.append(self.queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._batch.append(row)
+            batch, self._batch = self._batch, []
+            # shielded so that stopping the worker never abandons a batch
+            # that is already on its way to the database
+            self._flushing = asyncio.ensure_future(self._flush(batch))
+            await asyncio.shield(self._flushing)
+
+    async def _flush(self, batch: list[dict[str, Any]]) -> None:
+        if self.dropped > self._reported_dropped:
+            logger.warning(
+                f"request log queue full, {self.dropped - self._reported_dropped}"
+                " rows dropped"
+            )
+            self._reported_dropped = self.dropped
+        if not batch:
+            return
+        try:
+            await run_in_db(self._write, batch)
+        except Exception as e:
+            logger.error(f"failed to write {len(batch)} request log rows: {e}")
+
+    @staticmethod
+    def _write(batch: list[dict[str, Any]]) -> None:
+        values = ", ".join(
+            "(" + ", ".join(f":{col}_{i}" for col in COLUMNS) + ")"
+            for i in range(len(batch))
+        )
+        sql = f"""
+            INSERT INTO data_api_request_log ({", ".join(COLUMNS)})
+            VALUES {values};
+        """
+        params = {
+            f"{col}_{i}": row[col] for i, row in enumerate(batch) for col in COLUMNS
+        }
+        db: Session = next(get_db())
+        try:
+            db.execute(text(sql), params=params)
+            db.commit()
+        finally:
+            db.close()
+
+
+request_log = RequestLogWriter()